@@ -0,0 +1,58 @@
+"""
+Compares entry lookup throughput of the blocking MTQuery path against
+AsyncMTQuery with asyncio.gather. Runs against the database in config.py:
+
+    python benchmarks/async_throughput.py [number of lookups] [limit]
+
+The shared object cache is disabled so every lookup reaches the database.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyMovableType.aio import AsyncMTQuery, asyncio
+from pyMovableType.cache import object_cache
+from pyMovableType.query import MTQuery
+
+
+def entry_ids(count):
+    rows, results = MTQuery().conn.execute("""SELECT entry_id
+                                                FROM mt_entry
+                                               ORDER BY entry_id
+                                               LIMIT %s""", (count,))
+    return [row['entry_id'] for row in results]
+
+
+def blocking(ids):
+    mtquery = MTQuery()
+    return [mtquery.get_entry(x) for x in ids]
+
+
+def gathered(ids, limit):
+    aq = AsyncMTQuery(limit)
+    loop = asyncio.get_event_loop()
+    try:
+        return loop.run_until_complete(
+            aq.gather(*[aq.get_entry(x) for x in ids]))
+    finally:
+        aq.close()
+
+
+def report(label, func):
+    object_cache.clear()
+    start = time.time()
+    entries = func()
+    elapsed = time.time() - start
+    print "%-20s %8d entries %10.3fs %10.1f lookups/s" % (
+        label, len(entries), elapsed, len(entries) / elapsed)
+
+
+if __name__ == '__main__':
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 2000
+    limit = len(sys.argv) > 2 and int(sys.argv[2]) or 5
+    object_cache.size = 0
+    ids = entry_ids(count)
+    report('blocking', lambda: blocking(ids))
+    report('gather (limit %d)' % limit, lambda: gathered(ids, limit))
@@ -0,0 +1,69 @@
+"""
+Compares the old one-query-per-row listing path against the bulk loading
+path in MTQuery.get_objects. Runs against the database in config.py:
+
+    python benchmarks/bulk_fetch.py [object_type] [limit]
+
+object_type defaults to tag; limit caps the number of ids used for the
+chunked (ids=...) run.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyMovableType.cache import object_cache
+from pyMovableType.query import MTQuery
+
+
+class CountingQuery(MTQuery):
+    """
+    MTQuery that counts the statements sent through its connection.
+    """
+
+    def __init__(self):
+        super(CountingQuery, self).__init__()
+        self.queries = 0
+        execute = self.conn.execute
+
+        def counted(*args, **kwargs):
+            self.queries += 1
+            return execute(*args, **kwargs)
+        self.conn.execute = counted
+
+
+def one_by_one(mtquery, object_type):
+    """
+    The listing path used before bulk loading: fetch every id, then
+    SELECT each row on its own.
+    """
+    query = """SELECT %s_id
+                 FROM mt_%s""" % (object_type, object_type)
+    rows, results = mtquery.conn.execute(query)
+    return [mtquery.get_object(object_type, row['%s_id' % object_type])
+            for row in results]
+
+
+def run(label, func):
+    # Each run starts cold, so it isn't served from the previous one's
+    # cached objects
+    object_cache.clear()
+    mtquery = CountingQuery()
+    start = time.time()
+    objects = func(mtquery)
+    elapsed = time.time() - start
+    print "%-12s %8d objects %8d queries %10.3fs" % (label, len(objects),
+                                                     mtquery.queries,
+                                                     elapsed)
+    return objects
+
+
+if __name__ == '__main__':
+    object_type = len(sys.argv) > 1 and sys.argv[1] or 'tag'
+    limit = len(sys.argv) > 2 and int(sys.argv[2]) or 10000
+
+    objects = run('one-by-one', lambda q: one_by_one(q, object_type))
+    run('bulk', lambda q: q.get_objects(object_type))
+    ids = [x.id for x in objects[:limit]]
+    run('bulk ids', lambda q: q.get_objects(object_type, ids=ids))
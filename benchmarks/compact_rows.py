@@ -0,0 +1,73 @@
+"""
+Micro-benchmark of attribute access and memory per instance for models
+against compact MTRow objects (see pyMovableType/rows.py). Uses synthetic
+entry rows, so no database is needed:
+
+    python benchmarks/compact_rows.py [number of rows]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyMovableType.models import ColumnMap
+from pyMovableType.query import MTQuery
+from pyMovableType.rows import build_rows
+
+
+def entry_row(i):
+    return {'entry_id': i,
+            'entry_blog_id': 1,
+            'entry_status': 2,
+            'entry_author_id': i % 50,
+            'entry_title': 'Entry %d' % i,
+            'entry_excerpt': '',
+            'entry_text': 'Text of entry %d' % i,
+            'entry_text_more': '',
+            'entry_basename': 'entry_%d' % i,
+            'entry_class': 'entry',
+            'entry_created_on': '2010-01-01 10:00:00',
+            'entry_authored_on': '2010-01-01 10:00:00',
+            'entry_modified_on': '2010-01-01 10:00:00',
+            'entry_week_number': 201001}
+
+
+def size_of(obj):
+    """
+    Bytes used by an instance, its __dict__ and the containers hanging off
+    it (the dirty tracking snapshot etc.), not counting shared values such
+    as the table's ColumnMap.
+    """
+    size = sys.getsizeof(obj)
+    for value in getattr(obj, '__dict__', {}).values():
+        if isinstance(value, (dict, set)) and\
+                not isinstance(value, ColumnMap):
+            size += sys.getsizeof(value)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+if __name__ == '__main__':
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+    rows = [entry_row(i) for i in range(1, count + 1)]
+    mtquery = MTQuery()
+    entries = [mtquery.build_object('entry', row) for row in rows]
+    compact = list(build_rows('entry', rows))
+    entry, row = entries[0], compact[0]
+
+    number = 200000
+    print "%-28s %12s %12s" % ('', 'model', 'compact')
+    for label, stmt in (('short name (x.title)', 'x.title'),
+                        ('column (x.entry_title)', 'x.entry_title'),
+                        ('id (x.id)', 'x.id')):
+        timings = [min(timeit.Timer(stmt, 'from __main__ import %s as x' %
+                                    name).repeat(3, number))
+                   for name in ('entry', 'row')]
+        print "%-28s %10.0fns %10.0fns" % (label,
+                                           timings[0] / number * 1e9,
+                                           timings[1] / number * 1e9)
+    print "%-28s %10dB %11dB" % ('bytes per instance',
+                                 sum(map(size_of, entries)) / count,
+                                 sum(map(size_of, compact)) / count)
@@ -0,0 +1,252 @@
+"""
+Fills the tables created by schema.py with synthetic data for the
+benchmarks in run.py:
+
+    python benchmarks/generate.py --entries 100000 --depth 8
+
+Every run recreates the tables first (see schema.py). Rows are written
+with multi-row INSERTs of --chunk rows at a time, with ids assigned here
+so entries, placements, tags and meta rows can refer to each other
+without reading anything back. The random seed is fixed, so the same
+options always produce the same data.
+"""
+import datetime
+import optparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyMovableType.config import MT_BULK_INSERT_SIZE
+from pyMovableType.connect import MTConnection
+from pyMovableType.models import MTModel
+from schema import create_schema
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+# Custom fields defined in each blog, as (basename, type, object type)
+FIELDS = [('subtitle', 'text', 'entry'),
+          ('featured', 'checkbox', 'entry'),
+          ('sidebar', 'textarea', 'entry'),
+          ('banner', 'textarea', 'category')]
+
+# Meta column each field type's values are stored in
+META_COLUMNS = {'text': 'vchar_idx',
+                'textarea': 'vclob',
+                'checkbox': 'vinteger_idx'}
+
+START_DATE = datetime.datetime(2006, 1, 1)
+
+
+def get_options():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--entries', type='int', default=10000)
+    parser.add_option('--blogs', type='int', default=1)
+    parser.add_option('--authors', type='int', default=50)
+    parser.add_option('--categories', type='int', default=200,
+                      help="categories per blog")
+    parser.add_option('--depth', type='int', default=5,
+                      help="levels in each blog's category tree")
+    parser.add_option('--tags', type='int', default=1000)
+    parser.add_option('--tags-per-entry', type='int', default=3)
+    parser.add_option('--text-size', type='int', default=2000,
+                      help="characters of entry_text per entry")
+    parser.add_option('--chunk', type='int', default=MT_BULK_INSERT_SIZE,
+                      help="rows per INSERT")
+    parser.add_option('--seed', type='int', default=1)
+    return parser.parse_args()[0]
+
+
+class Generator(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.conn = MTConnection()
+        self.counts = {}
+
+    def words(self, count):
+        return ' '.join([self.random.choice(WORDS) for x in range(count)])
+
+    def text(self, size):
+        text = self.words(size / 6 + 1)
+        return text[:size]
+
+    def date(self, i, total):
+        """
+        Spreads rows evenly over the years since START_DATE, in id order.
+        """
+        return START_DATE + datetime.timedelta(hours=i * 24 * 365 * 5 /
+                                               max(total, 1))
+
+    def insert(self, table, columns, rows):
+        """
+        Writes rows (a generator of value tuples) chunk rows at a time.
+        """
+        columns = ['%s_%s' % (table, x) for x in columns]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.options.chunk:
+                self.write(table, columns, chunk)
+                chunk = []
+        if chunk:
+            self.write(table, columns, chunk)
+
+    def write(self, table, columns, chunk):
+        query = MTModel.get_statement('insert', table, columns, len(chunk))
+        args = []
+        for row in chunk:
+            args.extend(row)
+        self.conn.execute(query, args)
+        self.counts[table] = self.counts.get(table, 0) + len(chunk)
+
+    def authors(self):
+        for i in range(1, self.options.authors + 1):
+            yield (i, 'author%d' % i, 'Author %d' % i,
+                   'author%d@example.com' % i, 'author%d' % i, 1, 1,
+                   START_DATE, START_DATE)
+
+    def categories(self):
+        """
+        Each blog's categories form trees options.depth levels deep: the
+        first category of every run of depth is a top level one, and each
+        of the rest is a child of the one before it. Every tenth tree is
+        made of folders rather than categories, as MT uses for pages.
+        """
+        depth = max(self.options.depth, 1)
+        category_id = 0
+        self.category_ids = {}
+        for blog_id in range(1, self.options.blogs + 1):
+            self.category_ids[blog_id] = []
+            for i in range(self.options.categories):
+                category_id += 1
+                level = i % depth
+                parent = level and category_id - 1 or 0
+                is_folder = (i / depth) % 10 == 9
+                if not is_folder:
+                    self.category_ids[blog_id].append(category_id)
+                yield (category_id, blog_id, 'Category %d' % category_id,
+                       self.words(8), 1, parent, 'category_%d' % category_id,
+                       is_folder and 'folder' or 'category', 0, START_DATE,
+                       START_DATE)
+
+    def tags(self):
+        for i in range(1, self.options.tags + 1):
+            yield (i, 'tag%d' % i, 0, 0)
+
+    def entries(self):
+        total = self.options.entries
+        for i in range(1, total + 1):
+            date = self.date(i, total)
+            yield (i, i % self.options.blogs + 1, 2,
+                   self.random.randint(1, self.options.authors), 1, 0,
+                   self.words(6), self.words(30),
+                   self.text(self.options.text_size),
+                   self.text(self.options.text_size / 4), '1', '',
+                   'entry_%d' % i, 'entry',
+                   int(date.strftime('%Y%W')), date, date, date, 1, 1)
+
+    def placements(self):
+        for i in range(1, self.options.entries + 1):
+            blog_id = i % self.options.blogs + 1
+            categories = self.category_ids[blog_id]
+            if categories:
+                yield (i, blog_id, i, self.random.choice(categories), 1)
+
+    def objecttags(self):
+        objecttag_id = 0
+        count = min(self.options.tags_per_entry, self.options.tags)
+        for i in range(1, self.options.entries + 1):
+            blog_id = i % self.options.blogs + 1
+            # Skewed towards low ids, so some tags are far more popular
+            tag_ids = set()
+            while len(tag_ids) < count:
+                tag_ids.add(int(self.random.paretovariate(1.2)) %
+                            self.options.tags + 1)
+            for tag_id in sorted(tag_ids):
+                objecttag_id += 1
+                yield (objecttag_id, blog_id, 'entry', i, tag_id)
+
+    def fields(self):
+        field_id = 0
+        for blog_id in range(1, self.options.blogs + 1):
+            for basename, field_type, obj_type in FIELDS:
+                field_id += 1
+                yield (field_id, blog_id, basename.capitalize(), basename,
+                       basename, field_type, obj_type)
+
+    def meta(self, obj_type, ids):
+        """
+        Gives every other object a value for each of its type's fields.
+        """
+        fields = [(x[0], x[1]) for x in FIELDS if x[2] == obj_type]
+        for i in ids:
+            if i % 2:
+                continue
+            for basename, field_type in fields:
+                if field_type == 'checkbox':
+                    value = self.random.randint(0, 1)
+                elif field_type == 'text':
+                    value = self.words(4)
+                else:
+                    value = self.text(self.options.text_size / 2)
+                yield (i, 'field.%s' % basename, field_type, value)
+
+    def meta_rows(self, rows):
+        """
+        Splits (id, type, field type, value) into the meta table's columns.
+        """
+        for object_id, meta_type, field_type, value in rows:
+            values = {'vchar_idx': None, 'vclob': None, 'vinteger_idx': None}
+            values[META_COLUMNS[field_type]] = value
+            yield (object_id, meta_type, values['vchar_idx'],
+                   values['vclob'], values['vinteger_idx'])
+
+    def run(self):
+        options = self.options
+        create_schema()
+        self.insert('author', ['id', 'name', 'nickname', 'email', 'basename',
+                               'type', 'status', 'created_on', 'modified_on'],
+                    self.authors())
+        self.insert('category', ['id', 'blog_id', 'label', 'description',
+                                 'author_id', 'parent', 'basename', 'class',
+                                 'allow_pings', 'created_on', 'modified_on'],
+                    self.categories())
+        self.insert('tag', ['id', 'name', 'n8d_id', 'is_private'],
+                    self.tags())
+        self.insert('field', ['id', 'blog_id', 'name', 'basename', 'tag',
+                              'type', 'obj_type'], self.fields())
+        self.insert('entry', ['id', 'blog_id', 'status', 'author_id',
+                              'allow_comments', 'allow_pings', 'title',
+                              'excerpt', 'text', 'text_more',
+                              'convert_breaks', 'keywords', 'basename',
+                              'class', 'week_number', 'created_on',
+                              'authored_on', 'modified_on', 'created_by',
+                              'modified_by'], self.entries())
+        self.insert('placement', ['id', 'blog_id', 'entry_id', 'category_id',
+                                  'is_primary'], self.placements())
+        self.insert('objecttag', ['id', 'blog_id', 'object_datasource',
+                                  'object_id', 'tag_id'], self.objecttags())
+        meta_columns = ['type', 'vchar_idx', 'vclob', 'vinteger_idx']
+        self.insert('entry_meta', ['entry_id'] + meta_columns,
+                    self.meta_rows(self.meta('entry',
+                                             range(1, options.entries + 1))))
+        category_ids = []
+        for ids in self.category_ids.values():
+            category_ids.extend(ids)
+        self.insert('category_meta', ['category_id'] + meta_columns,
+                    self.meta_rows(self.meta('category', category_ids)))
+        return self.counts
+
+
+if __name__ == '__main__':
+    options = get_options()
+    start = time.time()
+    counts = Generator(options).run()
+    for table in sorted(counts.keys()):
+        print "%-14s %10d rows" % (table, counts[table])
+    print "%.1fs" % (time.time() - start)
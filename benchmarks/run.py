@@ -0,0 +1,272 @@
+"""
+Times the main MTQuery and model operations against a database filled by
+generate.py (the one in config.py):
+
+    python benchmarks/run.py [--iterations 200] [--output results.json]
+                             [--compare baseline.json] [operation ...]
+
+For each operation it reports latency percentiles, the number of queries
+each call sends, and peak memory. Each operation runs in a forked child
+of its own, with a fresh connection pool, so one operation's objects and
+peak RSS don't count against the next. The object cache is cleared
+before every call unless --warm is given.
+
+Results can be written as JSON with --output, and an earlier file passed
+to --compare to print the change for each operation next to the results.
+"""
+import json
+import optparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyMovableType import connect
+from pyMovableType import instrument
+from pyMovableType import query
+from pyMovableType.cache import object_cache
+from pyMovableType.models import Entry
+
+
+def get_options():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option('--iterations', type='int', default=200)
+    parser.add_option('--batch', type='int', default=100,
+                      help="ids per get_entries call")
+    parser.add_option('--blog', type='int', default=1)
+    parser.add_option('--warm', action='store_true', default=False,
+                      help="keep the object cache between calls")
+    parser.add_option('--seed', type='int', default=1)
+    parser.add_option('--output')
+    parser.add_option('--compare')
+    return parser.parse_args()
+
+
+class Benchmarks(object):
+    """
+    Each bench_* method returns a function that performs one call of the
+    operation. Setup (picking ids etc.) isn't timed.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        mtquery = query.MTQuery()
+        rows, results = mtquery.conn.execute(
+            """SELECT MIN(entry_id) AS low, MAX(entry_id) AS high
+                 FROM mt_entry""")
+        self.low, self.high = results[0]['low'], results[0]['high']
+        if self.low is None:
+            raise Exception("No entries; run generate.py first")
+
+    def entry_id(self):
+        return self.random.randint(self.low, self.high)
+
+    def bench_get_entry(self):
+        return lambda: query.MTQuery().get_entry(self.entry_id())
+
+    def bench_get_entries(self):
+        return lambda: query.MTQuery().get_entries(
+            [self.entry_id() for x in range(self.options.batch)])
+
+    def bench_load_fields(self):
+        """
+        Loads a batch of entries with their custom field values.
+        """
+        def load():
+            mtquery = query.MTQuery()
+            mtquery.load_fields(mtquery.get_entries(
+                [self.entry_id() for x in range(self.options.batch)]))
+        return load
+
+    def bench_get_objects(self):
+        return lambda: query.MTQuery().get_objects('author')
+
+    def bench_get_categories(self):
+        return lambda: query.MTQuery().get_categories(self.options.blog)
+
+    def bench_get_category(self):
+        """
+        Looks up the category deepest in the blog's tree and walks up
+        its chain of parents.
+        """
+        mtquery = query.MTQuery()
+        tree = mtquery.get_category_tree(self.options.blog)
+        deepest = None
+        depth = -1
+        for category in tree:
+            length = len(tree.path(category).split('/'))
+            if length > depth:
+                deepest, depth = category, length
+        object_cache.clear()
+
+        def walk():
+            category = query.MTQuery().get_category(deepest.id)
+            while category:
+                category = category.parent
+        return walk
+
+    def bench_get_tags(self):
+        return lambda: query.MTQuery().get_tags()
+
+    def bench_save(self):
+        def save():
+            entry = Entry.get(self.entry_id())
+            entry.title = 'Benchmark %s' % time.time()
+            entry.save()
+        return save
+
+    def bench_iter_entries(self):
+        """
+        Streams every entry in the blog once per call, so this one is
+        limited to a few iterations.
+        """
+        def iterate():
+            for entry in query.MTQuery().iter_entries(self.options.blog):
+                pass
+        return iterate
+
+# Operations, in the order they're run
+OPERATIONS = ['get_entry', 'get_entries', 'load_fields', 'get_objects',
+              'get_categories', 'get_category', 'get_tags', 'save',
+              'iter_entries']
+
+# Iterations for operations that walk a whole table
+LIMITED = {'iter_entries': 3}
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak / 1024
+    return peak
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a sorted list.
+    """
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def measure(name, options):
+    benchmarks = Benchmarks(options)
+    call = getattr(benchmarks, 'bench_%s' % name)()
+    iterations = min(options.iterations, LIMITED.get(name,
+                                                     options.iterations))
+    baseline = peak_rss()
+    timings = []
+    queries = 0
+    for i in range(iterations):
+        if not options.warm:
+            object_cache.clear()
+            query.blog_field_types.clear()
+        with instrument.capture() as stats:
+            start = time.time()
+            call()
+            timings.append((time.time() - start) * 1000)
+        queries += stats.queries
+    timings.sort()
+    return {'iterations': iterations,
+            'mean_ms': sum(timings) / len(timings),
+            'p50_ms': percentile(timings, 50),
+            'p90_ms': percentile(timings, 90),
+            'p99_ms': percentile(timings, 99),
+            'max_ms': timings[-1],
+            'queries': float(queries) / iterations,
+            'peak_rss_kb': peak_rss(),
+            'rss_growth_kb': peak_rss() - baseline}
+
+
+def run_isolated(name, options):
+    """
+    Runs measure in a forked child and returns its result. The child gets
+    a connection pool of its own, as sharing the parent's sockets would
+    interleave their traffic. It has two connections, so iter_entries
+    can prefetch while its stream holds the other.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        status = 0
+        try:
+            try:
+                connect.reset_pools(size=2)
+                result = measure(name, options)
+            except Exception, e:
+                result = {'error': '%s: %s' % (e.__class__.__name__, e)}
+                status = 1
+            out = os.fdopen(write, 'w')
+            out.write(json.dumps(result))
+            out.close()
+        finally:
+            os._exit(status)
+    os.close(write)
+    data = os.fdopen(read).read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+# Line printed under an operation's results with the change from --compare
+DIFF_FORMAT = "%-15s %6s %+8.1f%% %+8.1f%% %+8.1f%% %+8.1f%% %+8.1f %+10d"
+
+
+def report(results, baseline=None):
+    print "%-15s %6s %9s %9s %9s %9s %8s %10s" % (
+        'operation', 'iter', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+        'queries', 'peak KB')
+    for name in OPERATIONS:
+        result = results.get(name)
+        if result is None:
+            continue
+        if 'error' in result:
+            print "%-15s %s" % (name, result['error'])
+            continue
+        print "%-15s %6d %9.2f %9.2f %9.2f %9.2f %8.1f %10d" % (
+            name, result['iterations'], result['p50_ms'], result['p90_ms'],
+            result['p99_ms'], result['max_ms'], result['queries'],
+            result['peak_rss_kb'])
+        before = baseline and baseline.get(name)
+        if before and 'error' not in before:
+            print DIFF_FORMAT % (
+                '  vs baseline', '',
+                change(before['p50_ms'], result['p50_ms']),
+                change(before['p90_ms'], result['p90_ms']),
+                change(before['p99_ms'], result['p99_ms']),
+                change(before['max_ms'], result['max_ms']),
+                result['queries'] - before['queries'],
+                result['peak_rss_kb'] - before['peak_rss_kb'])
+
+
+def change(before, after):
+    if not before:
+        return 0.0
+    return (after - before) * 100.0 / before
+
+
+if __name__ == '__main__':
+    options, names = get_options()
+    for name in names:
+        if name not in OPERATIONS:
+            raise Exception("Unknown operation %s (choose from %s)" %
+                            (name, ', '.join(OPERATIONS)))
+    names = names or OPERATIONS
+    baseline = None
+    if options.compare:
+        baseline = json.load(open(options.compare))['results']
+    results = {}
+    for name in names:
+        results[name] = run_isolated(name, options)
+    report(results, baseline)
+    if options.output:
+        out = open(options.output, 'w')
+        json.dump({'options': options.__dict__,
+                   'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'results': results}, out, indent=2, sort_keys=True)
+        out.close()
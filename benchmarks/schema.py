@@ -0,0 +1,178 @@
+"""
+The subset of the Movable Type 4.x schema used by pyMovableType, with MT's
+indexes, for creating a benchmark database on MySQL/MariaDB:
+
+    python benchmarks/schema.py
+
+creates the tables in the database named in config.py, dropping any that
+exist, so point config.py at a scratch database first.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pyMovableType.config import MT_DB_CHARSET
+from pyMovableType.connect import MTConnection
+
+META_COLUMNS = """
+    %(name)s_meta_type VARCHAR(75) NOT NULL,
+    %(name)s_meta_vchar VARCHAR(255),
+    %(name)s_meta_vchar_idx VARCHAR(255),
+    %(name)s_meta_vdatetime DATETIME,
+    %(name)s_meta_vdatetime_idx DATETIME,
+    %(name)s_meta_vinteger INTEGER,
+    %(name)s_meta_vinteger_idx INTEGER,
+    %(name)s_meta_vfloat FLOAT,
+    %(name)s_meta_vfloat_idx FLOAT,
+    %(name)s_meta_vblob MEDIUMBLOB,
+    %(name)s_meta_vclob MEDIUMTEXT,
+    PRIMARY KEY (%(name)s_meta_%(name)s_id, %(name)s_meta_type),
+    KEY %(name)s_meta_type_vchar (%(name)s_meta_type,
+                                  %(name)s_meta_vchar_idx),
+    KEY %(name)s_meta_type_vint (%(name)s_meta_type,
+                                 %(name)s_meta_vinteger_idx)
+"""
+
+TABLES = [
+    ('mt_author', """
+    author_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    author_name VARCHAR(255) NOT NULL,
+    author_nickname VARCHAR(255),
+    author_email VARCHAR(127),
+    author_url VARCHAR(255),
+    author_basename VARCHAR(255),
+    author_type SMALLINT NOT NULL DEFAULT 1,
+    author_status INTEGER DEFAULT 1,
+    author_created_on DATETIME,
+    author_modified_on DATETIME,
+    KEY author_name (author_name),
+    KEY author_email (author_email)
+    """),
+    ('mt_entry', """
+    entry_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    entry_blog_id INTEGER NOT NULL,
+    entry_status SMALLINT NOT NULL,
+    entry_author_id INTEGER NOT NULL,
+    entry_allow_comments TINYINT,
+    entry_allow_pings TINYINT,
+    entry_title VARCHAR(255),
+    entry_excerpt MEDIUMTEXT,
+    entry_text MEDIUMTEXT,
+    entry_text_more MEDIUMTEXT,
+    entry_convert_breaks VARCHAR(30),
+    entry_keywords MEDIUMTEXT,
+    entry_basename VARCHAR(255),
+    entry_class VARCHAR(255) DEFAULT 'entry',
+    entry_week_number INTEGER,
+    entry_created_on DATETIME,
+    entry_authored_on DATETIME,
+    entry_modified_on DATETIME,
+    entry_created_by INTEGER,
+    entry_modified_by INTEGER,
+    KEY entry_blog_class_status_date (entry_blog_id, entry_class,
+                                      entry_status, entry_authored_on),
+    KEY entry_author_id (entry_author_id),
+    KEY entry_basename (entry_basename),
+    KEY entry_modified_on (entry_modified_on),
+    KEY entry_week_number (entry_week_number)
+    """),
+    ('mt_category', """
+    category_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    category_blog_id INTEGER NOT NULL,
+    category_label VARCHAR(100) NOT NULL,
+    category_description MEDIUMTEXT,
+    category_author_id INTEGER,
+    category_parent INTEGER DEFAULT 0,
+    category_basename VARCHAR(255),
+    category_class VARCHAR(255) DEFAULT 'category',
+    category_allow_pings TINYINT DEFAULT 0,
+    category_created_on DATETIME,
+    category_modified_on DATETIME,
+    KEY category_blog_class (category_blog_id, category_class),
+    KEY category_parent (category_parent),
+    KEY category_basename (category_basename)
+    """),
+    ('mt_placement', """
+    placement_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    placement_blog_id INTEGER NOT NULL,
+    placement_entry_id INTEGER NOT NULL,
+    placement_category_id INTEGER NOT NULL,
+    placement_is_primary TINYINT NOT NULL,
+    KEY placement_entry_id (placement_entry_id),
+    KEY placement_category_id (placement_category_id),
+    KEY placement_is_primary (placement_is_primary)
+    """),
+    ('mt_tag', """
+    tag_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    tag_name VARCHAR(255) NOT NULL,
+    tag_n8d_id INTEGER DEFAULT 0,
+    tag_is_private TINYINT DEFAULT 0,
+    KEY tag_name (tag_name),
+    KEY tag_n8d_id (tag_n8d_id)
+    """),
+    ('mt_objecttag', """
+    objecttag_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    objecttag_blog_id INTEGER,
+    objecttag_object_datasource VARCHAR(50) NOT NULL,
+    objecttag_object_id INTEGER NOT NULL,
+    objecttag_tag_id INTEGER NOT NULL,
+    KEY objecttag_object (objecttag_object_datasource, objecttag_object_id),
+    KEY objecttag_tag_id (objecttag_tag_id),
+    KEY objecttag_blog_ds_tag (objecttag_blog_id,
+                               objecttag_object_datasource,
+                               objecttag_tag_id)
+    """),
+    ('mt_field', """
+    field_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    field_blog_id INTEGER NOT NULL DEFAULT 0,
+    field_name VARCHAR(255) NOT NULL,
+    field_basename VARCHAR(255),
+    field_tag VARCHAR(255),
+    field_type VARCHAR(50) NOT NULL,
+    field_obj_type VARCHAR(50) NOT NULL,
+    field_required TINYINT DEFAULT 0,
+    field_default MEDIUMTEXT,
+    field_options MEDIUMTEXT,
+    KEY field_blog_id (field_blog_id),
+    KEY field_basename (field_basename)
+    """),
+    ('mt_entry_meta', """
+    entry_meta_entry_id INTEGER NOT NULL,
+    """ + META_COLUMNS % {'name': 'entry'}),
+    ('mt_category_meta', """
+    category_meta_category_id INTEGER NOT NULL,
+    """ + META_COLUMNS % {'name': 'category'}),
+    ('mt_asset', """
+    asset_id INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    asset_blog_id INTEGER NOT NULL,
+    asset_class VARCHAR(255) DEFAULT 'file',
+    asset_label VARCHAR(255),
+    asset_description MEDIUMTEXT,
+    asset_file_ext VARCHAR(20),
+    asset_file_name VARCHAR(255),
+    asset_file_path VARCHAR(255),
+    asset_mime_type VARCHAR(255),
+    asset_url VARCHAR(255),
+    asset_parent INTEGER,
+    asset_created_by INTEGER,
+    asset_created_on DATETIME,
+    asset_modified_by INTEGER,
+    asset_modified_on DATETIME,
+    KEY asset_blog_class (asset_blog_id, asset_class),
+    KEY asset_modified_on (asset_modified_on)
+    """),
+]
+
+
+def create_schema():
+    conn = MTConnection()
+    for table, columns in TABLES:
+        conn.execute("DROP TABLE IF EXISTS %s" % table)
+        conn.execute("CREATE TABLE %s (%s) DEFAULT CHARSET=%s" %
+                     (table, columns, MT_DB_CHARSET))
+
+
+if __name__ == '__main__':
+    create_schema()
+    print "Created %d tables" % len(TABLES)
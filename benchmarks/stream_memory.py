@@ -0,0 +1,49 @@
+"""
+Compares peak memory of listing a table with MTQuery.get_objects against
+streaming it with MTQuery.iter_objects. Runs against the database in
+config.py:
+
+    python benchmarks/stream_memory.py [object_type] [blog_id]
+
+Each mode runs in its own process, since peak RSS only ever grows.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def measure(mode, object_type, blog_id):
+    from pyMovableType.query import MTQuery
+
+    mtquery = MTQuery()
+    start = time.time()
+    count = 0
+    if mode == 'list':
+        objects = mtquery.get_objects(object_type, blog_id)
+        count = len(objects)
+    else:
+        for obj in mtquery.iter_objects(object_type, blog_id):
+            count += 1
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak / 1024
+    print "%-6s %10d objects %10.3fs %10d KB peak RSS" % (mode, count,
+                                                          elapsed, peak)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('list', 'iter'):
+        blog_id = sys.argv[3] != '0' and int(sys.argv[3]) or None
+        measure(sys.argv[1], sys.argv[2], blog_id)
+    else:
+        object_type = len(sys.argv) > 1 and sys.argv[1] or 'entry'
+        blog_id = len(sys.argv) > 2 and sys.argv[2] or '0'
+        for mode in ('list', 'iter'):
+            subprocess.call([sys.executable, __file__, mode,
+                             object_type, blog_id])
@@ -0,0 +1,123 @@
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import query
+
+from config import *
+
+
+class AsyncMTQuery(object):
+
+    def __init__(self, limit=MT_DB_POOL_SIZE, loop=None):
+        """
+        asyncio front end for MTQuery and model get/save. Database calls
+        still go through MySQLdb, but run on a bounded thread pool so they
+        don't block the event loop:
+
+        import trollius as asyncio
+        from trollius import From, Return
+
+        @asyncio.coroutine
+        def load(ids):
+            aq = AsyncMTQuery(limit=5)
+            entry = yield From(aq.get_entry(5))
+            entries = yield From(aq.gather(*[aq.get_entry(x) for x in ids]))
+            raise Return(entries)
+
+        entries = asyncio.get_event_loop().run_until_complete(load(ids))
+
+        The package is Python 2 only, so coroutines are written with
+        trollius, which has no await: a coroutine waits for a future with
+        yield From(...) and returns with raise Return(...).
+
+        Every MTQuery get_* method is available as a method returning a
+        future, e.g. aq.get_entry(5) or aq.get_tags().
+
+        At most `limit` calls run at once, one per executor thread, each
+        using its own MTQuery and a connection from the shared pool; any
+        more wait in the executor's queue. So gathering thousands of
+        lookups never holds more than `limit` connections. The limit
+        defaults to the pool size, since more threads than pooled
+        connections would only wait on the pool instead.
+        """
+        self.limit = limit
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(limit)
+
+    def run(self, func, *args):
+        """
+        Schedules func(*args) on the executor and returns a future for its
+        result.
+        """
+        loop = self.loop or asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, func, *args)
+
+    def __getattr__(self, name):
+        if not name.startswith('get_') or\
+                not hasattr(query.MTQuery, name):
+            raise AttributeError(name)
+
+        def call(*args):
+            return self.run(run_query, name, args)
+        return call
+
+    def get(self, model, obj_id):
+        """
+        Future returning counterpart to MTModel.get, e.g.
+        entry = yield From(aq.get(Entry, 5))
+        """
+        return self.run(model.get, obj_id)
+
+    def save(self, obj):
+        """
+        Future returning counterpart to MTModel.save.
+        """
+        return self.run(obj.save)
+
+    def gather(self, *futures):
+        """
+        Waits for all the given futures and returns their results in
+        order, like asyncio.gather.
+        """
+        return asyncio.gather(*futures)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def run_query(name, args):
+    """
+    MTQuery instances aren't shared between threads, so each call gets its
+    own (they only hold a connection while a statement runs).
+    """
+    return getattr(query.MTQuery(), name)(*args)
+
+
+# Shared instance used by the module level get and save
+default_query = None
+
+
+def get_default_query():
+    global default_query
+    if default_query is None:
+        default_query = AsyncMTQuery()
+    return default_query
+
+
+def get(model, obj_id):
+    """
+    MTModel.get on the shared AsyncMTQuery, returning a future:
+    entry = yield From(aio.get(Entry, 5))
+    """
+    return get_default_query().get(model, obj_id)
+
+
+def save(obj):
+    """
+    MTModel.save on the shared AsyncMTQuery, returning a future:
+    yield From(aio.save(entry))
+    """
+    return get_default_query().save(obj)
@@ -0,0 +1,141 @@
+import threading
+import time
+
+from config import *
+
+
+class MTObjectCache(object):
+
+    def __init__(self, size=MT_CACHE_SIZE, ttl=MT_CACHE_TTL):
+        """
+        A process-wide identity map of loaded objects, keyed by
+        (table, id), e.g. ('author', 12). Since every MTQuery shares it,
+        resolving the same author or category again returns the instance
+        that was already loaded instead of querying for it.
+
+        The least recently used items are evicted once more than `size`
+        are stored, and items older than `ttl` seconds are dropped when
+        they're next looked up. A size of 0 disables caching; a ttl of 0
+        keeps items until they're evicted or invalidated.
+
+        An id of None is used for lists covering a whole table, such as
+        the list of all tags returned by MTQuery.get_tags.
+        """
+        self.size = size
+        self.ttl = ttl
+        # (table, id) -> [previous, next, key, object, time stored]; the
+        # links form a circular list from the least to the most recently
+        # used item, which OrderedDict would do on Python 2.7 and later
+        self.items = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None]
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0,
+                         'misses': 0,
+                         'evictions': 0,
+                         'expirations': 0,
+                         'invalidations': 0}
+
+    def get(self, table, object_id):
+        """
+        Returns the cached object, or None if it isn't cached (or has
+        expired).
+        """
+        key = (table, object_id)
+        self.lock.acquire()
+        try:
+            link = self.items.get(key)
+            if link is not None and self.ttl and\
+                    time.time() - link[4] > self.ttl:
+                self.counters['expirations'] += 1
+                self.remove(key)
+                link = None
+            if link is None:
+                self.counters['misses'] += 1
+                return None
+            # Move to the end to mark the key as the most recently used
+            self.unlink(link)
+            self.append(link)
+            self.counters['hits'] += 1
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def set(self, table, object_id, obj):
+        if not self.size:
+            return
+        key = (table, object_id)
+        self.lock.acquire()
+        try:
+            self.remove(key)
+            link = [None, None, key, obj, time.time()]
+            self.items[key] = link
+            self.append(link)
+            while len(self.items) > self.size:
+                self.remove(self.root[1][2])
+                self.counters['evictions'] += 1
+        finally:
+            self.lock.release()
+
+    def invalidate(self, table, object_id):
+        self.lock.acquire()
+        try:
+            if self.remove((table, object_id)):
+                self.counters['invalidations'] += 1
+        finally:
+            self.lock.release()
+
+    def clear(self, table=None):
+        """
+        Drops every cached object for the given table, or everything if no
+        table is given.
+        """
+        self.lock.acquire()
+        try:
+            keys = [x for x in self.items.keys()
+                    if table is None or x[0] == table]
+            for key in keys:
+                self.remove(key)
+            self.counters['invalidations'] += len(keys)
+        finally:
+            self.lock.release()
+
+    def append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = link
+        self.root[0] = link
+
+    def unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def remove(self, key):
+        """
+        Drops a key, returning whether it was cached. The lock must be
+        held.
+        """
+        link = self.items.pop(key, None)
+        if link is None:
+            return False
+        self.unlink(link)
+        return True
+
+    def stats(self):
+        """
+        Returns a snapshot of the cache counters, e.g.:
+        {'hits': 5120, 'misses': 310, 'evictions': 0, 'expirations': 12,
+         'invalidations': 4, 'size': 10000, 'items': 298}
+        """
+        self.lock.acquire()
+        try:
+            stats = dict(self.counters)
+            stats['items'] = len(self.items)
+        finally:
+            self.lock.release()
+        stats['size'] = self.size
+        return stats
+
+
+object_cache = MTObjectCache()
@@ -1,4 +1,50 @@
 MT_DB_HOST='localhost'
+# Read replicas of MT_DB_HOST as 'host' or 'host:port'; MTQuery reads are
+# spread across them, and writes always go to MT_DB_HOST
+MT_DB_REPLICAS=[]
 MT_DB_USER='mt_user'
 MT_DB_PASSWD='pass1234'
 MT_DB_NAME='mt'
+# Character set of the MT database, used by the driver to encode values
+MT_DB_CHARSET='latin1'
+
+# Maximum number of ids per WHERE ... IN (...) query when loading in bulk
+MT_BULK_CHUNK_SIZE = 1000
+
+# Connection pool shared by MTQuery and MTModel: maximum number of open
+# connections, seconds to wait for a free one, and seconds a connection may
+# sit idle before it's pinged on checkout
+MT_DB_POOL_SIZE = 5
+MT_DB_POOL_TIMEOUT = 30
+MT_DB_POOL_PING_INTERVAL = 60
+
+# Seconds a thread keeps reading from the primary after it writes, so it
+# sees its own changes despite replication lag; 0 disables it
+MT_DB_PRIMARY_PIN_TIME = 5
+
+# Maximum number of rows per multi-row INSERT in MTModel.bulk_save
+MT_BULK_INSERT_SIZE = 500
+
+# Shared object cache (see cache.MTObjectCache): maximum number of cached
+# objects and the seconds they stay valid; a size of 0 disables caching
+MT_CACHE_SIZE = 10000
+MT_CACHE_TTL = 300
+
+# Rows fetched per round trip when streaming with MTQuery.iter_objects
+MT_STREAM_BATCH_SIZE = 1000
+
+# Ids per shard handed to a worker process by export.MTExportRunner
+MT_EXPORT_SHARD_SIZE = 1000
+
+# Statements slower than this many seconds are logged as warnings to the
+# pyMovableType.slow logger (see connect.MTSlowQueryLog); None disables it
+MT_SLOW_QUERY_TIME = None
+
+# Times a statement can repeat within an instrument.capture block before
+# it's reported as a likely N+1 query
+MT_REPEATED_QUERY_THRESHOLD = 20
+
+# Seconds of modified_on history re-read at the start of each change feed
+# run (see feed.MTChangeFeed), for rows saved with the same timestamp as
+# the last one delivered
+MT_FEED_OVERLAP = 2
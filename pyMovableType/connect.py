@@ -1,47 +1,599 @@
+import logging
 import MySQLdb
 import MySQLdb.cursors
 import os
+import Queue
+import itertools
+import re
+import threading
+import time
 
 from config import *
 
+# MySQL client errors after which a connection can't be reused:
+# server has gone away, lost connection during query
+CONNECTION_LOST_ERRORS = (2006, 2013)
+
+# Statements that can be sent to a replica
+READ_STATEMENT = re.compile(r'\s*(SELECT|SHOW|DESCRIBE|EXPLAIN)\b', re.I)
+
+# Instrumentation listeners (see MTListener), notified of every statement
+# and new connection. Kept empty unless something is listening, so the
+# execute path only pays for a truth test.
+listeners = []
+
+
+def add_listener(listener):
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in listeners:
+        listeners.remove(listener)
 
-class MTConnection(object):
 
-    def __init__(self):
+class MTListener(object):
+    """
+    Base class for instrumentation listeners. Listeners are called in the
+    thread that ran the statement, after it completes.
+    """
+
+    def on_statement(self, query, args, rows, elapsed):
+        """
+        Called with the statement and its parameters, the number of rows
+        returned (or affected, for writes) and the seconds it took.
+        """
+        pass
+
+    def on_connect(self, elapsed):
+        """
+        Called when the pool opens a new database connection.
+        """
+        pass
+
+
+class MTSlowQueryLog(MTListener):
+
+    def __init__(self, threshold=MT_SLOW_QUERY_TIME, logger=None):
+        """
+        Logs statements taking longer than threshold seconds as warnings.
+        Set MT_SLOW_QUERY_TIME to enable it for every connection, or add
+        one with add_listener.
+        """
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger('pyMovableType.slow')
+
+    def on_statement(self, query, args, rows, elapsed):
+        if elapsed >= self.threshold:
+            self.logger.warning("%.3fs, %d rows: %s %r", elapsed, rows,
+                                ' '.join(query.split()), args)
+
+
+class MTConnectionPool(object):
+
+    def __init__(self, size=MT_DB_POOL_SIZE, timeout=MT_DB_POOL_TIMEOUT,
+                 ping_interval=MT_DB_POOL_PING_INTERVAL, host=MT_DB_HOST):
+        """
+        A bounded, thread-safe pool of MySQLdb connections to `host`
+        ('host' or 'host:port'). At most `size`
+        connections are ever opened; once they are all checked out,
+        checkout() blocks for up to `timeout` seconds waiting for one to be
+        returned.
+
+        Connections that have sat idle for longer than `ping_interval`
+        seconds are pinged on checkout and replaced if the server has gone
+        away, so a checked out connection is always usable without paying
+        a round trip on every checkout.
+        """
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.host = host
+        self.port = 3306
+        if ':' in host:
+            self.host, port = host.rsplit(':', 1)
+            self.port = int(port)
+        # Replicas that can't be reached are skipped until this time
+        self.down_until = 0
+        self.idle = Queue.LifoQueue(size)
+        self.lock = threading.Lock()
+        # Notified when a connection is checked in or a slot is freed
+        self.available = threading.Condition(self.lock)
+        self.opened = 0
+        self.counters = {'checkouts': 0,
+                         'hits': 0,
+                         'misses': 0,
+                         'waits': 0,
+                         'wait_time': 0.0,
+                         'max_wait_time': 0.0,
+                         'failed_pings': 0}
+
+    def connect(self):
         """
         self.conn uses a DictCursor, which returns rows in dictionary form.
         This allows for accessing rows by column name rather than numeric
         indexes.
+
+        Connections run in autocommit mode, since a pooled connection must
+        not carry an open transaction over to its next user. See
+        MTConnection.begin for explicit transactions.
+
+        The connection's charset is MT_DB_CHARSET. Model values are
+        already encoded in it by MTModel.format_value, and the driver
+        encodes any other unicode parameters. Results are still returned
+        as byte strings, as before the charset was set explicitly.
+        """
+        conn = MySQLdb.connect(host=self.host,
+                               port=self.port,
+                               user=MT_DB_USER,
+                               passwd=MT_DB_PASSWD,
+                               db=MT_DB_NAME,
+                               charset=MT_DB_CHARSET,
+                               use_unicode=False,
+                               cursorclass=MySQLdb.cursors.DictCursor)
+        conn.autocommit(True)
+        return conn
+
+    def checkout(self):
+        """
+        Returns an idle connection if there is one (a hit), opens a new one
+        if the pool isn't full yet (a miss) and otherwise waits for another
+        thread to check one in.
+        """
+        try:
+            conn, last_used = self.idle.get_nowait()
+            hit = True
+        except Queue.Empty:
+            if self.reserve():
+                conn, last_used = None, None
+                hit = False
+            else:
+                conn, last_used = self.wait()
+                hit = conn is not None
+        if conn is not None and\
+                time.time() - last_used > self.ping_interval:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                # Replace the dead connection, keeping its slot
+                self.record('failed_pings', 1)
+                self.close_quietly(conn)
+                conn = None
+                hit = False
+        if conn is None:
+            start = listeners and time.time()
+            try:
+                conn = self.connect()
+            except:
+                self.unreserve()
+                raise
+            if start:
+                for listener in listeners:
+                    listener.on_connect(time.time() - start)
+        self.record('checkouts', 1)
+        self.record(hit and 'hits' or 'misses', 1)
+        return conn
+
+    def reserve(self):
+        """
+        Claims a slot for a new connection, returning False if the pool
+        is already full.
+        """
+        self.lock.acquire()
+        try:
+            if self.opened < self.size:
+                self.opened += 1
+                return True
+            return False
+        finally:
+            self.lock.release()
+
+    def unreserve(self):
+        """
+        Frees a slot, waking a thread waiting for one (see wait).
         """
-        self.conn = MySQLdb.connect(host="localhost",
-                                    user=MT_DB_USER,
-                                    passwd=MT_DB_PASSWD,
-                                    db=MT_DB_NAME,
-                                    cursorclass=MySQLdb.cursors.DictCursor)
-        self.cursor = self.conn.cursor()
+        self.available.acquire()
+        try:
+            self.opened -= 1
+            self.available.notify()
+        finally:
+            self.available.release()
 
-    def execute(self, query):
+    def wait(self):
+        """
+        Waits for a connection to be checked in, or for a slot freed by
+        discard(). Returns (None, None) when it claimed a slot, and the
+        caller opens the connection.
+        """
+        start = time.time()
+        self.available.acquire()
+        try:
+            while True:
+                try:
+                    conn, last_used = self.idle.get_nowait()
+                    break
+                except Queue.Empty:
+                    pass
+                if self.opened < self.size:
+                    self.opened += 1
+                    conn, last_used = None, None
+                    break
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    raise Exception("No database connection became "
+                                    "available within %s seconds (pool "
+                                    "size %d)" % (self.timeout, self.size))
+                self.available.wait(remaining)
+            waited = time.time() - start
+            self.counters['waits'] += 1
+            self.counters['wait_time'] += waited
+            if waited > self.counters['max_wait_time']:
+                self.counters['max_wait_time'] = waited
+        finally:
+            self.available.release()
+        return conn, last_used
+
+    def checkin(self, conn):
+        self.available.acquire()
+        try:
+            self.idle.put_nowait((conn, time.time()))
+            self.available.notify()
+        finally:
+            self.available.release()
+
+    def discard(self, conn):
+        """
+        Closes a connection that should not go back into the pool, e.g.
+        one that failed mid-query, freeing its slot for a waiting thread.
+        """
+        self.unreserve()
+        self.close_quietly(conn)
+
+    def close_quietly(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def record(self, counter, amount):
+        self.lock.acquire()
+        try:
+            self.counters[counter] += amount
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool counters, e.g.:
+        {'checkouts': 120, 'hits': 115, 'misses': 5, 'waits': 2,
+         'wait_time': 0.004, 'max_wait_time': 0.003, 'failed_pings': 0,
+         'size': 5, 'opened': 5, 'idle': 4, 'host': 'localhost:3306'}
+        """
+        self.lock.acquire()
+        try:
+            stats = dict(self.counters)
+            stats['opened'] = self.opened
+        finally:
+            self.lock.release()
+        stats['size'] = self.size
+        stats['idle'] = self.idle.qsize()
+        stats['host'] = '%s:%d' % (self.host, self.port)
+        return stats
+
+    def close(self):
+        """
+        Closes every idle connection. Connections that are checked out
+        at the time go back into the pool as usual when they're checked
+        in, and are only closed by a later close().
+        """
+        while True:
+            try:
+                conn, last_used = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            self.discard(conn)
+
+
+default_pool = None
+replica_pools = []
+# Pools a forked process inherited from its parent, see reset_pools
+inherited_pools = []
+next_replica = itertools.count()
+# Per-thread read routing state, see use_primary and pin_primary
+routing = threading.local()
+
+
+def reset_pools(size=MT_DB_POOL_SIZE, forked=False):
+    """
+    Creates the pool for the primary (MT_DB_HOST) and one per replica in
+    MT_DB_REPLICAS. Also used by forked worker processes (forked=True),
+    which must not share their parent's connections. The inherited pools
+    are kept in inherited_pools rather than freed: freeing a MySQLdb
+    connection closes it, which would close the socket under the parent
+    too.
+    """
+    global default_pool, replica_pools
+    if forked and default_pool is not None:
+        inherited_pools.append(default_pool)
+        inherited_pools.extend(replica_pools)
+    default_pool = MTConnectionPool(size=size)
+    replica_pools = [MTConnectionPool(size=size, host=x)
+                     for x in MT_DB_REPLICAS]
+
+
+def get_read_pool():
+    """
+    Returns the pool to send a read to: the next replica in turn, or the
+    primary if there are no replicas that are up or the thread is pinned
+    to it.
+    """
+    now = time.time()
+    if not replica_pools or getattr(routing, 'primary', 0) or\
+            getattr(routing, 'pinned_until', 0) > now:
+        return default_pool
+    for i in range(len(replica_pools)):
+        pool = replica_pools[next_replica.next() % len(replica_pools)]
+        if pool.down_until <= now:
+            return pool
+    return default_pool
+
+
+def pin_primary(seconds=MT_DB_PRIMARY_PIN_TIME):
+    """
+    Sends the current thread's reads to the primary for the next seconds.
+    Called after every write, so a thread reads its own writes even when
+    the replicas lag behind.
+    """
+    if seconds:
+        routing.pinned_until = max(getattr(routing, 'pinned_until', 0),
+                                   time.time() + seconds)
+
+
+class use_primary(object):
+    """
+    Context manager sending every read in the block to the primary, for
+    code that can't tolerate any replication lag:
+
+    with use_primary():
+        entry = q.get_entry(5)
+    """
+
+    def __enter__(self):
+        routing.primary = getattr(routing, 'primary', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        routing.primary -= 1
+        return False
+
+
+reset_pools()
+
+if MT_SLOW_QUERY_TIME is not None:
+    add_listener(MTSlowQueryLog())
+
+
+class MTConnection(object):
+
+    def __init__(self, pool=None, readonly=False):
+        """
+        MTConnections don't own a database connection. One is checked out
+        of the shared pool for each statement and returned as soon as its
+        rows are fetched, so MTQuery and MTModel instances can be created
+        freely without opening connections. Between begin() and
+        commit()/rollback() the same connection is held for every
+        statement.
+
+        Statements go to the primary (MT_DB_HOST) unless readonly is set,
+        as it is for MTQuery. A readonly connection sends each SELECT to
+        the next replica in MT_DB_REPLICAS, falling back to the primary if
+        the replica can't be reached; anything else, and everything in a
+        transaction, still goes to the primary. Writes pin the thread to
+        the primary for MT_DB_PRIMARY_PIN_TIME seconds (see pin_primary).
+        Passing a pool uses that pool for everything.
+        """
+        self.pool = pool
+        self.readonly = readonly
+        self.conn = None
+        self.conn_pool = None
+        self.cursor = None
+        self.lastrowid = None
+        self.in_transaction = False
+
+    def get_pool(self, query=None):
+        if self.pool is not None:
+            return self.pool
+        if self.readonly and replica_pools and query is not None and\
+                READ_STATEMENT.match(query):
+            return get_read_pool()
+        return default_pool
+
+    def checkout(self, query=None):
+        """
+        Returns a connection for the query and the pool it came from.
+        """
+        pool = self.get_pool(query)
+        try:
+            conn = pool.checkout()
+        except MySQLdb.OperationalError, e:
+            if pool is default_pool or pool is self.pool:
+                raise
+            # Skip the replica until it's time to try it again
+            pool.down_until = time.time() + pool.ping_interval
+            logging.getLogger('pyMovableType').warning(
+                "Replica %s unavailable, reading from the primary: %s",
+                pool.host, e)
+            pool = default_pool
+            conn = pool.checkout()
+        return conn, pool
+
+    def acquire(self, query=None):
+        if self.conn is None:
+            self.conn, self.conn_pool = self.checkout(query)
+            self.cursor = self.conn.cursor()
+
+    def release(self):
+        if self.conn is not None and not self.in_transaction:
+            conn = self.conn
+            self.conn = None
+            self.cursor = None
+            self.conn_pool.checkin(conn)
+
+    def execute(self, query, args=None):
         """
         Simple wrapper that returns a tuple with 2 items:
         (number of rows impacted by query, fetched rows)
 
         Example usage:
-        rows, results = self.conn.execute(query)
+        rows, results = self.conn.execute(query, (entry_id,))
         rows is an int, results is a dict with keys matching the
         names of columns from the queried tables
+
+        Values should be passed in args and referenced as %s in the query
+        rather than formatted into it, so the driver escapes them and the
+        query string stays the same for every call.
+        """
+        start = listeners and time.time()
+        self.acquire(query)
+        try:
+            rows = self.cursor.execute(query, args)
+            results = self.cursor.fetchall()
+            self.lastrowid = self.cursor.lastrowid
+            if replica_pools and self.conn_pool is default_pool and\
+                    not READ_STATEMENT.match(query):
+                pin_primary()
+        except MySQLdb.OperationalError, e:
+            """
+            If the connection itself is broken (server gone away, lost
+            connection), don't hand it to anyone else.
+            """
+            if e.args and e.args[0] not in CONNECTION_LOST_ERRORS:
+                raise
+            self.discard()
+            raise
+        finally:
+            self.release()
+        if start:
+            elapsed = time.time() - start
+            for listener in listeners:
+                listener.on_statement(query, args, len(results) or rows,
+                                      elapsed)
+        return (rows, results)
+
+    def iterate(self, query, args=None, batch_size=MT_STREAM_BATCH_SIZE):
+        """
+        Generator version of execute for queries with large results. Rows
+        are streamed from the server with an unbuffered SSDictCursor,
+        batch_size at a time, so only the current batch is held in memory:
+
+        for row in self.conn.iterate(query):
+            ...
+
+        The rows are read over a connection of the generator's own,
+        checked out until it's exhausted or closed, since a connection
+        can't run other statements until all the rows have been read.
+        Statements run with this MTConnection while iterating (e.g. to
+        prefetch related objects for each batch) use other connections
+        from the pool. In a transaction, the transaction's connection is
+        used, and nothing else can be run on it until iterating is done.
+        """
+        start = listeners and time.time()
+        count = 0
+        if self.in_transaction:
+            conn, pool = self.conn, None
+        else:
+            conn, pool = self.checkout(query)
+        cursor = None
+        lost = False
+        try:
+            cursor = conn.cursor(MySQLdb.cursors.SSDictCursor)
+            cursor.execute(query, args)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield row
+        except MySQLdb.OperationalError, e:
+            lost = bool(e.args and e.args[0] in CONNECTION_LOST_ERRORS)
+            raise
+        finally:
+            if cursor is not None and not lost:
+                # Closing an unbuffered cursor reads and discards any
+                # rows left
+                cursor.close()
+            if pool is not None:
+                if lost:
+                    pool.discard(conn)
+                else:
+                    pool.checkin(conn)
+            elif lost:
+                self.discard()
+            if start:
+                # Timed from the start of the query to the last row read,
+                # including the time spent by the caller between batches
+                elapsed = time.time() - start
+                for listener in listeners:
+                    listener.on_statement(query, args, count, elapsed)
+
+    def begin(self):
+        """
+        Starts a transaction. The connection stays checked out until
+        commit() or rollback() is called.
+        """
+        self.acquire()
+        self.conn.autocommit(False)
+        self.in_transaction = True
+
+    def commit(self):
+        self.end('commit')
+
+    def rollback(self):
+        self.end('rollback')
+
+    def end(self, finish):
+        if self.conn is None:
+            # The connection was lost and discarded mid-transaction
+            self.in_transaction = False
+            return
+        try:
+            getattr(self.conn, finish)()
+            self.conn.autocommit(True)
+        except:
+            """
+            The connection may still be in the transaction, or have
+            autocommit off, so it mustn't go back into the pool where the
+            next user's writes would silently join it.
+            """
+            self.discard()
+            raise
+        self.in_transaction = False
+        self.release()
+
+    def discard(self):
+        """
+        Closes the current connection rather than returning it to the
+        pool, e.g. after it was lost or left in an unknown state.
         """
-        rows = self.cursor.execute(query)
-        return (rows, self.cursor.fetchall())
+        conn = self.conn
+        self.conn = None
+        self.cursor = None
+        self.in_transaction = False
+        self.conn_pool.discard(conn)
 
     def last_inserted_id(self):
         """
         Useful for determining the id of the last item inserted,
         e.g. you create and store a new entry.
         """
-        return self.cursor.lastrowid
+        return self.lastrowid
 
     def close(self):
-        self.conn.close()
+        if self.in_transaction:
+            self.rollback()
+        self.release()
 
 
 if __name__ == '__main__':
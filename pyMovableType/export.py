@@ -0,0 +1,225 @@
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+
+import connect
+import models
+import query
+
+from config import *
+
+# Columns left out of exported records, by table: MT4 keeps the API
+# password in plain text, and the others are credentials too
+EXCLUDED_COLUMNS = {'author': ('password', 'api_password',
+                               'remote_auth_token')}
+
+
+class MTExportRunner(object):
+
+    def __init__(self, object_type='entry', output=None, format='jsonl',
+                 callback=None, blog_id=None, processes=None,
+                 shard_size=MT_EXPORT_SHARD_SIZE, checkpoint=None,
+                 progress=None):
+        """
+        Exports (or transforms) a whole table in parallel, e.g.:
+
+        runner = MTExportRunner('entry', output='entries.jsonl',
+                                checkpoint='entries.checkpoint')
+        runner.run()
+
+        The table's id range is split into shards of shard_size ids, which
+        are processed by a pool of worker processes (one per core by
+        default), each with its own database connection. A worker loads
+        its shard's rows with one query and, for entries, attaches their
+        authors, categories and placements in bulk (see
+        MTQuery.prefetch_entries).
+
+        Each object is either written to output, as JSON lines or CSV
+        (format='jsonl' or 'csv'), or passed to callback in the worker.
+        The callback has to be a module level function so it can be sent
+        to the workers.
+
+        Shards are completed in id order. After each one, the last
+        completed id is written to the checkpoint file if one is given,
+        and a later run with the same checkpoint resumes after it,
+        appending to output. progress, if given, is called after each
+        shard as progress(objects done, shards done, total shards,
+        last completed id).
+        """
+        self.object_type = object_type
+        self.output = output
+        self.format = format
+        self.callback = callback
+        self.blog_id = blog_id
+        self.processes = processes or multiprocessing.cpu_count()
+        self.shard_size = shard_size
+        self.checkpoint = checkpoint
+        self.progress = progress
+
+    def get_id_range(self):
+        sql = """SELECT MIN(%s_id) AS low, MAX(%s_id) AS high
+                   FROM mt_%s""" % (self.object_type, self.object_type,
+                                    self.object_type)
+        args = []
+        if self.blog_id:
+            sql += """ WHERE %s_blog_id = %%s""" % self.object_type
+            args.append(self.blog_id)
+        rows, results = query.MTQuery().conn.execute(sql, args)
+        return results[0]['low'], results[0]['high']
+
+    def get_shards(self):
+        """
+        Returns a list of (first id, last id) ranges covering the ids left
+        to process.
+        """
+        low, high = self.get_id_range()
+        if low is None:
+            return []
+        last_id = self.read_checkpoint()
+        if last_id is not None:
+            low = max(low, last_id + 1)
+        return [(x, min(x + self.shard_size - 1, high))
+                for x in range(low, high + 1, self.shard_size)]
+
+    def read_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+        f = open(self.checkpoint)
+        try:
+            state = json.load(f)
+        finally:
+            f.close()
+        if state.get('object_type') != self.object_type:
+            raise Exception("Checkpoint %s is for %s, not %s" %
+                            (self.checkpoint, state.get('object_type'),
+                             self.object_type))
+        return state['last_id']
+
+    def write_checkpoint(self, last_id):
+        """
+        Written to a temporary file and renamed into place, so a crash
+        can't leave a truncated checkpoint.
+        """
+        temp = '%s.tmp' % self.checkpoint
+        f = open(temp, 'w')
+        try:
+            json.dump({'object_type': self.object_type,
+                       'last_id': last_id}, f)
+        finally:
+            f.close()
+        os.rename(temp, self.checkpoint)
+
+    def run(self):
+        """
+        Processes every remaining shard and returns the number of objects
+        exported.
+        """
+        shards = self.get_shards()
+        resuming = self.read_checkpoint() is not None
+        out = None
+        writer = None
+        if self.output:
+            out = open(self.output, resuming and 'ab' or 'wb')
+        tasks = [(self.object_type, self.blog_id, low, high, self.callback,
+                  self.output and self.format or None)
+                 for low, high in shards]
+        # Idle connections would be inherited by every worker for nothing
+        connect.default_pool.close()
+        pool = multiprocessing.Pool(self.processes, init_worker)
+        done = 0
+        try:
+            for i, result in enumerate(pool.imap(export_shard, tasks)):
+                count, records = result
+                if out is not None and records:
+                    if self.format == 'csv':
+                        if writer is None:
+                            writer = csv.DictWriter(out,
+                                                    sorted(records[0].keys()),
+                                                    extrasaction='ignore')
+                            if not resuming:
+                                writer.writerow(dict([(x, x) for x in
+                                                      writer.fieldnames]))
+                        writer.writerows(records)
+                    else:
+                        for record in records:
+                            out.write(record)
+                            out.write('\n')
+                    out.flush()
+                done += count
+                last_id = shards[i][1]
+                if self.checkpoint:
+                    self.write_checkpoint(last_id)
+                if self.progress:
+                    self.progress(done, i + 1, len(shards), last_id)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            if out is not None:
+                out.close()
+        return done
+
+
+def init_worker():
+    """
+    Forked workers must not share the parent's pooled connections, so each
+    gets pools of its own with a single connection (see
+    connect.reset_pools).
+    """
+    connect.reset_pools(size=1, forked=True)
+
+
+def export_shard(task):
+    """
+    Loads and processes the objects with ids in [low, high]. Returns the
+    number of objects and, when writing output, their serialized records.
+    """
+    object_type, blog_id, low, high, callback, format = task
+    mtquery = query.MTQuery()
+    filters = {'id__gte': low, 'id__lte': high}
+    if blog_id:
+        filters['blog_id'] = blog_id
+    className = getattr(models, object_type.capitalize())
+    objects = list(className.filter(**filters).order_by('id'))
+    if object_type == 'entry':
+        mtquery.prefetch_entries(objects)
+    records = []
+    for obj in objects:
+        if callback is not None:
+            callback(obj)
+        if format == 'csv':
+            records.append(serialize(obj, flat=True))
+        elif format:
+            records.append(json.dumps(serialize(obj),
+                                      encoding=models.get_codec()))
+    # Keep the worker's memory flat from shard to shard
+    mtquery.cache.clear()
+    return len(objects), records
+
+
+def serialize(obj, flat=False):
+    """
+    Returns a dict of an object's columns keyed by short name. Related
+    objects (entry.author etc.) are included as nested dicts unless flat
+    is set. Credentials (see EXCLUDED_COLUMNS) are never included.
+    """
+    record = {}
+    prefix = '%s_' % obj.className
+    excluded = EXCLUDED_COLUMNS.get(obj.className, ())
+    for key, value in obj.__dict__.items():
+        if key.startswith(prefix) and key[len(prefix):] in excluded:
+            continue
+        if isinstance(value, models.MTModel):
+            if key.startswith(prefix):
+                record[key[len(prefix):]] = value.id
+            elif not flat:
+                record[key] = serialize(value, flat)
+        elif key.startswith(prefix):
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                value = value.strftime('%Y-%m-%d %H:%M:%S')
+            record[key[len(prefix):]] = value
+    return record
@@ -0,0 +1,199 @@
+import datetime
+import json
+import os
+
+import models
+import query
+
+from config import *
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class MTChangeFeed(object):
+
+    def __init__(self, object_type='entry', watermark=None, blog_id=None,
+                 batch_size=MT_STREAM_BATCH_SIZE, overlap=MT_FEED_OVERLAP,
+                 sync_cache=True):
+        """
+        Delivers the objects of a table that changed since the last run,
+        for keeping a search index, CDN or other copy in sync without
+        re-reading the whole table:
+
+        feed = MTChangeFeed('entry', watermark='entries.watermark')
+        for batch in feed.batches():
+            reindex(batch)
+
+        Rows are read in (modified_on, id) order, batch_size at a time,
+        with keyset pagination (see MTQuerySet.after), so each run costs
+        in proportion to the rows that changed. Entries come with their
+        author, category and placement attached, loaded in bulk per batch.
+
+        The position of the last object delivered is the watermark. It's
+        saved to the watermark file, if one is given, once the consumer
+        asks for the next batch (or the run ends), so a batch that wasn't
+        finished is delivered again by the next run. Each run also
+        re-reads the last `overlap` seconds before the watermark, since
+        modified_on only has a resolution of a second and rows saved in
+        the same second as the watermark could otherwise be missed. So
+        objects can be delivered more than once, and consumers should be
+        idempotent.
+
+        The watermark also holds the highest id delivered, and rows with
+        a higher id are delivered whatever their modified_on, since new
+        rows can be inserted with an older one (e.g. an archive import,
+        where an entry's modified_on defaults to its created_on).
+
+        Tables without a modified_on column (e.g. tag) are followed by
+        id, which only picks up new rows. Rows with no modified_on are
+        only delivered when they're new, and deleted rows can't be seen
+        at all.
+
+        With sync_cache, each delivered object replaces any stale copy in
+        the shared object cache (see MTModel.refresh_cache).
+        """
+        self.object_type = object_type
+        self.watermark = watermark
+        self.blog_id = blog_id
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self.sync_cache = sync_cache
+        self.mtquery = query.MTQuery()
+        self.model = getattr(models, object_type.capitalize())
+        self.modified_column = '%s_modified_on' % object_type
+        if self.modified_column not in\
+                self.mtquery.get_table_columns(object_type):
+            self.modified_column = None
+        self.position = self.read_watermark()
+
+    def read_watermark(self):
+        """
+        Returns the saved position, {'modified_on': ..., 'id': ...,
+        'max_id': ...}, or None if nothing has been delivered yet.
+        """
+        if not self.watermark or not os.path.exists(self.watermark):
+            return None
+        f = open(self.watermark)
+        try:
+            state = json.load(f)
+        finally:
+            f.close()
+        if state.get('object_type') != self.object_type or\
+                state.get('blog_id') != self.blog_id:
+            raise Exception("Watermark %s is for %s in blog %s" %
+                            (self.watermark, state.get('object_type'),
+                             state.get('blog_id')))
+        return state['position']
+
+    def write_watermark(self):
+        temp = '%s.tmp' % self.watermark
+        f = open(temp, 'w')
+        try:
+            json.dump({'object_type': self.object_type,
+                       'blog_id': self.blog_id,
+                       'position': self.position}, f)
+        finally:
+            f.close()
+        # Renamed into place so the watermark is never half written
+        os.rename(temp, self.watermark)
+
+    def reset(self):
+        """
+        Forgets the watermark, so the next run delivers every object.
+        """
+        self.position = None
+        if self.watermark and os.path.exists(self.watermark):
+            os.remove(self.watermark)
+
+    def get_queryset(self):
+        queryset = self.model.filter()
+        if self.blog_id:
+            queryset = queryset.filter(blog_id=self.blog_id)
+        if self.modified_column is None:
+            queryset = queryset.order_by('id')
+            if self.position:
+                queryset = queryset.filter(id__gt=self.position['id'])
+            return queryset
+        queryset = queryset.order_by('modified_on', 'id')
+        if self.position:
+            # Watermarks saved before max_id was kept only have the id
+            max_id = self.position.get('max_id', self.position['id'])
+            # modified_on >= start OR id > max_id, which filter() can't
+            # express
+            queryset = queryset.clone()
+            if self.position['modified_on'] is None:
+                # Only rows without a modified_on were delivered so far
+                queryset.where.append("(%s IS NOT NULL OR %s > %%s)" %
+                                      (self.modified_column,
+                                       queryset.column('id')))
+                queryset.args.append(max_id)
+                return queryset
+            start = datetime.datetime.strptime(self.position['modified_on'],
+                                               TIME_FORMAT)
+            start -= datetime.timedelta(seconds=self.overlap)
+            queryset.where.append("(%s >= %%s OR %s > %%s)" %
+                                  (self.modified_column,
+                                   queryset.column('id')))
+            queryset.args.extend([start.strftime(TIME_FORMAT), max_id])
+        return queryset
+
+    def fetch(self, page):
+        """
+        Loads a page of changed rows as new objects rather than through
+        the cache, which may hold the old versions.
+        """
+        sql, args = page.build_query()
+        rows, results = self.mtquery.conn.execute(sql, args)
+        objects = [self.mtquery.build_object(self.object_type, row)
+                   for row in results]
+        if self.sync_cache:
+            for obj in objects:
+                obj.refresh_cache()
+        if self.object_type == 'entry':
+            self.mtquery.prefetch_entries(objects)
+        return objects
+
+    def advance(self, objects):
+        """
+        Moves the watermark past a delivered batch.
+        """
+        obj = objects[-1]
+        modified_on = None
+        if self.modified_column is not None:
+            modified_on = obj.__dict__[self.modified_column]
+            if hasattr(modified_on, 'strftime'):
+                modified_on = modified_on.strftime(TIME_FORMAT)
+        max_id = max([x.id for x in objects])
+        if self.position:
+            max_id = max(max_id, self.position.get('max_id', 0))
+            # A run that only found new rows with an older modified_on
+            # mustn't move the watermark back
+            previous = self.position['modified_on']
+            if previous and (modified_on is None or previous > modified_on):
+                modified_on = previous
+        self.position = {'modified_on': modified_on, 'id': obj.id,
+                         'max_id': max_id}
+
+    def batches(self):
+        """
+        Yields lists of up to batch_size changed objects, oldest change
+        first, advancing the watermark as each batch is consumed.
+        """
+        queryset = self.get_queryset()
+        page = queryset[:self.batch_size]
+        while True:
+            objects = self.fetch(page)
+            if not objects:
+                break
+            yield objects
+            self.advance(objects)
+            if self.watermark:
+                self.write_watermark()
+            if len(objects) < self.batch_size:
+                break
+            page = queryset.after(objects[-1])[:self.batch_size]
+
+    def __iter__(self):
+        for batch in self.batches():
+            for obj in batch:
+                yield obj
@@ -0,0 +1,177 @@
+import logging
+import os
+import re
+import thread
+import traceback
+
+import connect
+
+from config import *
+
+# Rules normalising a statement to its fingerprint, applied in order
+FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'"(?:[^"\\]|\\.)*"'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bNULL\b', re.I), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+'), r'\1'),
+    (re.compile(r'\s+'), ' '),
+]
+
+# Fingerprints of statements already seen; statements are mostly reused
+# (see MTModel.get_statement), so this stays small
+fingerprints = {}
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger('pyMovableType.instrument')
+
+
+def fingerprint(query):
+    """
+    Returns the statement with its literal values, placeholders and
+    value lists replaced, so every run of the same statement with
+    different values has the same fingerprint:
+
+    >>> fingerprint("SELECT * FROM mt_entry WHERE entry_id IN (%s, %s)")
+    'SELECT * FROM mt_entry WHERE entry_id IN (...)'
+    """
+    result = fingerprints.get(query)
+    if result is None:
+        result = query
+        for pattern, replacement in FINGERPRINT_RULES:
+            result = pattern.sub(replacement, result)
+        result = result.strip()
+        if len(fingerprints) > 10000:
+            fingerprints.clear()
+        fingerprints[query] = result
+    return result
+
+
+def call_site():
+    """
+    Returns 'file:line in function' for the innermost frame outside this
+    package, i.e. the code that caused the statement to run.
+    """
+    for filename, line, function, text in reversed(traceback.extract_stack()):
+        if not os.path.abspath(filename).startswith(PACKAGE_DIR):
+            return '%s:%d in %s' % (filename, line, function)
+    return 'unknown'
+
+
+class MTQueryStats(connect.MTListener):
+
+    def __init__(self, all_threads=False,
+                 repeat_threshold=MT_REPEATED_QUERY_THRESHOLD):
+        """
+        Collects statistics for the statements run while it's listening,
+        usually through capture():
+
+        >>> with capture() as stats:
+        ...     entries = MTQuery().get_entries(ids)
+        >>> stats.queries, stats.time, stats.connections
+        (4, 0.012, 0)
+        >>> print stats.report()
+
+        Statements are grouped by fingerprint, with the number of runs,
+        total time and rows of each in stats.statements. Only statements
+        from the thread that started capturing are counted, unless
+        all_threads is set.
+
+        A fingerprint that runs repeat_threshold times within the block is
+        almost always a query issued once per object in a loop (an N+1
+        query). It's logged as a warning to the pyMovableType.instrument
+        logger, with the call site, and recorded in stats.repeated.
+        """
+        self.all_threads = all_threads
+        self.repeat_threshold = repeat_threshold
+        self.thread_id = thread.get_ident()
+        self.queries = 0
+        self.rows = 0
+        self.time = 0.0
+        self.connections = 0
+        self.connect_time = 0.0
+        self.statements = {}
+        self.repeated = {}
+
+    def on_statement(self, query, args, rows, elapsed):
+        if not self.all_threads and thread.get_ident() != self.thread_id:
+            return
+        self.queries += 1
+        self.rows += rows
+        self.time += elapsed
+        key = fingerprint(query)
+        stats = self.statements.get(key)
+        if stats is None:
+            stats = {'count': 0, 'time': 0.0, 'rows': 0, 'max_time': 0.0}
+            self.statements[key] = stats
+        stats['count'] += 1
+        stats['time'] += elapsed
+        stats['rows'] += rows
+        if elapsed > stats['max_time']:
+            stats['max_time'] = elapsed
+        if stats['count'] == self.repeat_threshold:
+            site = call_site()
+            self.repeated[key] = site
+            logger.warning("Statement ran %d times, likely an N+1 query "
+                           "(from %s): %s", stats['count'], site, key)
+
+    def on_connect(self, elapsed):
+        if not self.all_threads and thread.get_ident() != self.thread_id:
+            return
+        self.connections += 1
+        self.connect_time += elapsed
+
+    def start(self):
+        connect.add_listener(self)
+
+    def stop(self):
+        connect.remove_listener(self)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def top(self, count=10, key='time'):
+        """
+        Returns the count (fingerprint, stats) pairs with the highest
+        total time, or the highest 'count' or 'rows'.
+        """
+        items = self.statements.items()
+        items.sort(key=lambda x: x[1][key], reverse=True)
+        return items[:count]
+
+    def report(self, count=10):
+        lines = ["%d queries, %d rows, %.3fs, %d new connections" %
+                 (self.queries, self.rows, self.time, self.connections)]
+        for key, stats in self.top(count):
+            lines.append("%6d x %8.3fs %8d rows  %s" % (stats['count'],
+                                                        stats['time'],
+                                                        stats['rows'], key))
+        for key, site in self.repeated.items():
+            lines.append("Repeated (N+1?) from %s: %s" % (site, key))
+        return '\n'.join(lines)
+
+
+def capture(**kwargs):
+    """
+    Returns an MTQueryStats to use as a context manager, see there.
+    """
+    return MTQueryStats(**kwargs)
+
+
+def enable_slow_log(threshold, logger=None):
+    """
+    Starts logging statements slower than threshold seconds, at runtime
+    rather than through MT_SLOW_QUERY_TIME. Returns the listener, to pass
+    to connect.remove_listener to stop.
+    """
+    listener = connect.MTSlowQueryLog(threshold, logger)
+    connect.add_listener(listener)
+    return listener
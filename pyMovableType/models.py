@@ -2,10 +2,61 @@ import datetime
 import time
 
 import query
+import queryset
+from cache import object_cache
 from connect import *
 
 
+class ColumnMap(dict):
+
+    def __init__(self, table):
+        """
+        Maps the short attribute names of a table's models to column names,
+        e.g. ColumnMap('entry')['title'] == 'entry_title'. Names are
+        formatted once, on first use, and looked up afterwards.
+        """
+        super(ColumnMap, self).__init__()
+        self.table = table
+        self.prefix = '%s_' % table
+
+    def __missing__(self, key):
+        column = self.prefix + key
+        self[key] = column
+        return column
+
+
+# One ColumnMap per table, shared by every model of that table
+column_maps = {}
+
+# Python codecs for MySQL character sets whose names differ
+CHARSET_CODECS = {'utf8mb3': 'utf-8', 'utf8mb4': 'utf-8'}
+
+
+def get_codec(charset=None):
+    """
+    Returns the name of the Python codec for a MySQL character set, by
+    default MT_DB_CHARSET.
+    """
+    charset = charset or MT_DB_CHARSET
+    return CHARSET_CODECS.get(charset, charset)
+
+
+def get_column_map(table):
+    columns = column_maps.get(table)
+    if columns is None:
+        columns = column_maps.setdefault(table, ColumnMap(table))
+    return columns
+
+
 class MTModel(object):
+    # Subclasses stored in another model's table (e.g. Page in mt_entry)
+    # set the table and the value of its class column
+    _table = None
+    _class = None
+    # Related objects loaded on first access, see load_related
+    _related = ()
+    # Large columns left out by defer=True (see MTQuery.get_objects)
+    _deferred_columns = ()
 
     def __init__(self, id=None, *args, **kwargs):
         self.className = self.__class__.__name__.lower()
@@ -16,25 +67,29 @@ class MTModel(object):
         as an insert or update, depending on whether or not an ID exists on the
         current model.
 
-        An MTConnection is opened and closed as needed to prevent too many
-        connections from being established at any given time (i.e. we don't
-        open the connection in self.__init__ because a connection would exist
-        for each model that gets instantiated, causing an error in some cases.
+        The MTConnection checks a database connection out of the shared pool
+        (see connect.MTConnectionPool) for each statement, so saving many
+        models reuses the same few connections instead of opening one per
+        save.
         """
         self.conn = MTConnection()
-        query = self.build_save_query()
-        rows, results = self.conn.execute(query)
+        if not self.id or self.is_dirty():
+            query, args = self.build_save_query()
+            rows, results = self.conn.execute(query, args)
 
-        if not self.id:
-            setattr(self, "%s_id" % self.className,
-                    self.conn.last_inserted_id())
+            if not self.id:
+                setattr(self, "%s_id" % self.className,
+                        self.conn.last_inserted_id())
+            self.mark_clean()
+            self.refresh_cache()
 
         """
         Run through the items in this model's dict, checking to see if any
         are subclasses of MTModel. If any are found, as would be the case
         with entries that have associated categories, placements, and authors,
         call the save() method for each to make sure any changes are
-        committed. It'd be nice to only save 'dirty' objects here.
+        committed. Related objects that haven't changed return from save()
+        without touching the database.
         """
         for key, obj in self.__dict__.items():
             if issubclass(type(obj), MTModel):
@@ -44,7 +99,7 @@ class MTModel(object):
 
     def build_save_query(self):
         """
-        This piece of nasty constructs a query to either INSERT or UPDATE
+        Returns the query and parameters to either INSERT or UPDATE
         a model depending on whether or not the current instance has an id.
         The big hole here is that we trust the user not to arbitrarily set
         an id on the model. Since I more or less trust myself, this has been
@@ -52,53 +107,310 @@ class MTModel(object):
         attempts to set the id?
 
         Only items in self.__dict__ that have keys preceeded by
-        the name of the model (e.g. 'entry_') are included. Depending on the
-        type of the item, it is either included inside or outside quotes so
-        we can pop it directly into a query string.
-
-        Obviously, no escaping is done here as would be necessary to prevent
-        SQL injection, because it wasn't needed at the time this was created.
-        """
-        values = []
-        columns = [x for x in self.__dict__.keys()\
-                       if x.find('%s_' % self.className) >= 0]
-        query = ''
-        for column in columns:
-            value = self.__dict__[column]
-            if isinstance(value, int):
-                values.append("%d" % value)
-            elif not value:
-                values.append("NULL")
-            else:
-                if isinstance(value, tuple):
-                    values.append("\"%s\"" % (', '.join(value)))
-                else:
-                    value = "%s" % value
-                    """
-                    We have to encode the value here as latin-1 (iso-8859-1)
-                    because our MT installation uses it.
-                    """
-                    value = value.encode('latin-1', 'replace')
-                    value = "\"%s\"" % value.replace('"', '\\"')
-                    values.append(value)
+        the name of the model (e.g. 'entry_') are included, and an UPDATE
+        only includes the columns changed since the model was loaded or last
+        saved (see get_dirty_columns). The query itself comes from the
+        class's statement cache (see get_statement) and values are bound as
+        parameters, so the driver does the escaping.
+        """
         if self.id:
-            # Object already exists, so we'll update rather than insert
-            pairs = []
-            for i in range(len(columns)):
-                pairs.append('%s = %s' % (columns[i], values[i]))
-            pairs = ', '.join(pairs)
-            query =\
-                "UPDATE mt_%s SET %s WHERE %s_id = %s" % (self.className,
-                                                          pairs,
-                                                          self.className,
-                                                          self.id)
+            self.touch()
+            columns = self.get_dirty_columns()
+            query = self.get_statement('update', self.className, columns)
+            args = [self.format_value(self.__dict__[column])
+                    for column in columns]
+            args.append(self.id)
         else:
-            columns = ', '.join(columns)
-            values = ', '.join(values)
-            query = "INSERT INTO mt_%s (%s) VALUES (%s)" % (self.className,
-                                                            columns,
-                                                            values)
-        return query
+            columns = self.get_columns()
+            query = self.get_statement('insert', self.className, columns)
+            args = [self.format_value(self.__dict__[column])
+                    for column in columns]
+        return query, args
+
+    def touch(self):
+        """
+        Sets modified_on to the current time, as MT does when it saves an
+        object, unless it has been assigned explicitly. Models without a
+        modified_on column (tags, placements etc.) are left as they are.
+        Updates have to move modified_on for feed.MTChangeFeed to pick
+        them up.
+        """
+        d = self.__dict__
+        column = '%smodified_on' % d['_columns'].prefix
+        if column in d and column not in d.get('_dirty', ()):
+            setattr(self, column,
+                    datetime.datetime.now().replace(microsecond=0))
+
+    @classmethod
+    def get_statement(self, kind, table, columns=(), rows=1):
+        """
+        Returns the SQL for an 'insert', 'update' or 'select' (by id) on
+        the given table and columns, with %s placeholders for the values.
+        Statements are built once per class and column set, and reused
+        for every later save or lookup:
+
+        >>> Author.get_statement('update', 'author', ['author_nickname'])
+        'UPDATE mt_author SET author_nickname = %s WHERE author_id = %s'
+
+        For 'insert', rows sets the number of value groups, for multi-row
+        INSERTs. MySQLdb interpolates the parameters client side, since it
+        has no server-side prepared statements.
+        """
+        statements = self.__dict__.get('_statements')
+        if statements is None:
+            statements = {}
+            self._statements = statements
+        key = (kind, table, tuple(columns), rows)
+        statement = statements.get(key)
+        if statement is None:
+            if kind == 'insert':
+                placeholders = "(%s)" % ', '.join(['%s'] * len(columns))
+                statement = "INSERT INTO mt_%s (%s) VALUES %s" %\
+                    (table, ', '.join(columns),
+                     ', '.join([placeholders] * rows))
+            elif kind == 'update':
+                pairs = ', '.join(['%s = %%s' % x for x in columns])
+                statement = "UPDATE mt_%s SET %s WHERE %s_id = %%s" %\
+                    (table, pairs, table)
+            elif kind == 'select':
+                statement = "SELECT * FROM mt_%s WHERE %s_id = %%s" %\
+                    (table, table)
+            else:
+                raise Exception("Unknown statement kind: %s" % kind)
+            statements[key] = statement
+        return statement
+
+    def get_columns(self):
+        """
+        Returns the keys in self.__dict__ that are columns of the model's
+        table, i.e. those preceeded by the name of the model (e.g. 'entry_'),
+        in sorted order.
+        """
+        prefix = self.__dict__['_columns'].prefix
+        return sorted([x for x in self.__dict__.keys() if prefix in x])
+
+    def get_dirty_columns(self):
+        """
+        Returns the columns that have been assigned a different value since
+        the model was created or last saved.
+        """
+        if '_dirty' not in self.__dict__:
+            return self.get_columns()
+        return [x for x in self.get_columns() if x in self.__dict__['_dirty']]
+
+    def is_dirty(self):
+        return bool(self.get_dirty_columns())
+
+    def mark_clean(self):
+        """
+        Records the current column values as the model's original values,
+        e.g. after it's been built from a database row or saved.
+        """
+        self.__dict__['_original'] = dict([(x, self.__dict__[x])
+                                           for x in self.get_columns()])
+        self.__dict__['_dirty'] = set()
+
+    @staticmethod
+    def format_value(value):
+        """
+        Converts a single column value to the query parameter that's
+        stored. Related objects stored in a column (e.g. category.parent)
+        are written as their id and empty values as NULL.
+
+        Unicode strings are encoded in MT_DB_CHARSET here rather than by
+        the driver, replacing characters the charset can't store (e.g.
+        curly quotes in latin1) with '?', as pyMovableType always has,
+        instead of failing the save.
+        """
+        if isinstance(value, MTModel):
+            value = value.id
+        if isinstance(value, (int, long)):
+            return value
+        elif not value:
+            return None
+        elif isinstance(value, tuple):
+            value = ', '.join(value)
+        if isinstance(value, unicode):
+            value = value.encode(get_codec(), 'replace')
+        return value
+
+    @classmethod
+    def bulk_save(self, objects, batch_size=MT_BULK_INSERT_SIZE):
+        """
+        Saves many models at once inside a single transaction, e.g.:
+        Entry.bulk_save(entries)
+
+        New objects are grouped by table (and column set) and written with
+        multi-row INSERT statements of up to batch_size rows each. The
+        auto-increment ids are assigned back onto each instance, so the
+        Placements and ObjectTags that depend on them can be built and
+        bulk saved next. Objects that already have an id are updated one
+        at a time within the same transaction, if they have changed.
+
+        Related objects (entry.author etc.) are not saved here, unlike
+        save(). Assigning the ids relies on MySQL handing out consecutive
+        ids for a multi-row INSERT, which holds unless
+        innodb_autoinc_lock_mode is set to 2 (interleaved).
+        """
+        inserted = []
+        written = []
+        links = self.get_links(objects)
+        conn = MTConnection()
+        conn.begin()
+        try:
+            self.write_many(conn, objects, batch_size, inserted, written)
+            conn.commit()
+        except:
+            conn.rollback()
+            self.forget_ids(inserted)
+            self.restore_links(links)
+            raise
+        for obj in written:
+            obj.mark_clean()
+            obj.refresh_cache()
+
+    @classmethod
+    def write_many(self, conn, objects, batch_size, inserted, written):
+        """
+        Does the writing for bulk_save on an MTConnection that's already
+        in a transaction, without committing. Objects are appended to
+        inserted and written as they're sent, so the caller can clean up
+        after a rollback (see forget_ids) or mark them clean after the
+        commit. Inserts are grouped in the order each table first appears
+        in objects.
+
+        Models held in the objects' columns (e.g. Placement(entry_id=entry))
+        are replaced by their ids once everything is written, so saved
+        and cached objects hold ids, as loaded ones do. See get_links for
+        putting them back after a rollback. A new model linking to a new
+        model of its own table (e.g. Category(parent=new_category)) is
+        inserted in a later INSERT than the one it links to (see
+        get_depth). Linking to a model that hasn't been written by the
+        time its id is needed raises an exception.
+        """
+        groups = {}
+        order = []
+        tables = []
+        updates = []
+        new = set([id(x) for x in objects if not x.id])
+        depths = {}
+        for obj in objects:
+            if obj.id:
+                updates.append(obj)
+                continue
+            if obj.className not in tables:
+                tables.append(obj.className)
+            key = (self.get_depth(obj, new, depths), obj.className,
+                   tuple(obj.get_columns()))
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(obj)
+        order.sort(key=lambda x: (tables.index(x[1]), x[0]))
+
+        for key in order:
+            depth, table, columns = key
+            group = groups[key]
+            for i in range(0, len(group), batch_size):
+                batch = group[i:i + batch_size]
+                args = []
+                for obj in batch:
+                    self.check_links(obj)
+                    args.extend([obj.format_value(obj.__dict__[column])
+                                 for column in columns])
+                conn.execute(self.get_statement('insert', table, columns,
+                                                len(batch)), args)
+                first_id = conn.last_inserted_id()
+                for offset, obj in enumerate(batch):
+                    setattr(obj, "%s_id" % table, first_id + offset)
+                    inserted.append(obj)
+                    written.append(obj)
+        for obj in updates:
+            if obj.is_dirty():
+                self.check_links(obj)
+                query, args = obj.build_save_query()
+                conn.execute(query, args)
+                written.append(obj)
+        for obj, values in self.get_links(objects):
+            for column, related in values.items():
+                obj.__dict__[column] = related.id
+
+    @classmethod
+    def get_depth(self, obj, new, depths):
+        """
+        Returns 0 for a new object that doesn't link to any other new
+        object of its table (the ids of the new objects are in new),
+        otherwise one more than the depth of the deepest one it links to.
+        Depths are kept in depths, by id(obj).
+        """
+        key = id(obj)
+        if key in depths:
+            if depths[key] is None:
+                raise Exception("%s objects link to each other in a "
+                                "loop" % obj.className.capitalize())
+            return depths[key]
+        depths[key] = None
+        depth = 0
+        for column in obj.get_columns():
+            value = obj.__dict__[column]
+            if isinstance(value, MTModel) and id(value) in new and\
+                    value.className == obj.className:
+                depth = max(depth, self.get_depth(value, new, depths) + 1)
+        depths[key] = depth
+        return depth
+
+    @staticmethod
+    def check_links(obj):
+        """
+        Raises an exception if the object links to a model that has no id
+        yet, which would be written as NULL.
+        """
+        for column in obj.get_columns():
+            value = obj.__dict__[column]
+            if isinstance(value, MTModel) and not value.id:
+                raise Exception("%s.%s links to a new %s that hasn't been "
+                                "saved before it" %
+                                (obj.className.capitalize(), column,
+                                 value.className.capitalize()))
+
+    @staticmethod
+    def get_links(objects):
+        """
+        Returns (object, {column: model}) for each of the objects holding
+        models in its columns, to be passed to restore_links if writing
+        them (see write_many) is rolled back.
+        """
+        links = []
+        for obj in objects:
+            d = obj.__dict__
+            values = dict([(x, d[x]) for x in obj.get_columns()
+                           if isinstance(d[x], MTModel)])
+            if values:
+                links.append((obj, values))
+        return links
+
+    @staticmethod
+    def restore_links(links):
+        for obj, values in links:
+            obj.__dict__.update(values)
+
+    @staticmethod
+    def forget_ids(objects):
+        """
+        Removes the ids assigned to inserted objects whose transaction was
+        rolled back, since those rows don't exist.
+        """
+        for obj in objects:
+            obj.__dict__.pop("%s_id" % obj.className, None)
+
+    def refresh_cache(self):
+        """
+        Called after the model is written. The saved instance replaces any
+        cached copy of the row, and cached lists of the whole table (e.g.
+        MTQuery.get_tags) are dropped.
+        """
+        object_cache.set(self.className, self.id, self)
+        object_cache.invalidate(self.className, None)
 
     def check_keys(self, expected_keys, got_keys):
         """
@@ -125,20 +437,78 @@ class MTModel(object):
         >>> e = Entry.get(55216)
         >>> e.title # rather than requiring e.entry_title
         'This is the title'
+
+        The values set here are the model's original values, against which
+        later changes are tracked (see __setattr__).
         """
+        columns = self.__dict__['_columns']
         for key in kwargs.keys():
             # Reformat keys to match appropriate table
-            setattr(self, '%s_%s' % (self.className, key), kwargs[key])
+            setattr(self, columns[key], kwargs[key])
+        self.mark_clean()
 
     def __getattr__(self, key):
-        table_key = "%s_%s" % (self.className, key)
-        return self.__dict__.get(table_key, self.__dict__.get(key))
+        """
+        Only called for names that aren't in the instance's __dict__:
+        short column names (e.g. title for entry_title), deferred columns,
+        which are loaded from the database now, and related objects that
+        haven't been loaded yet (see load_related).
+        """
+        d = self.__dict__
+        if key in self._related:
+            return self.load_related(key)
+        columns = d.get('_columns')
+        if columns is not None:
+            table_key = columns[key]
+            if table_key in d:
+                return d[table_key]
+            deferred = d.get('_deferred')
+            if deferred and (table_key in deferred or key in deferred):
+                query.MTQuery().load_deferred([self])
+                return d.get(table_key, d.get(key))
+        return d.get(key)
+
+    def load_related(self, key):
+        """
+        Loads and returns the related object named in the class's
+        _related, caching it on the instance. Subclasses with related
+        objects override this.
+        """
+        return self.__dict__.get(key)
 
     def __setattr__(self, name, value):
-        table_key = "%s_%s" % (self.__class__.__name__.lower(), name)
-        if table_key in self.__dict__:
-            name = table_key
-        self.__dict__[name] = value
+        """
+        Column assignments are tracked in self._dirty, so save() can write
+        only the changed columns. Setting a column back to its original
+        value clears it from the dirty set again.
+
+        Short names are resolved against className (rather than the class
+        name), so e.g. page.title sets the entry_title column of a Page.
+        """
+        d = self.__dict__
+        columns = d.get('_columns')
+        if columns is not None:
+            table_key = columns[name]
+            deferred = d.get('_deferred')
+            if table_key in d:
+                name = table_key
+            elif deferred and table_key in deferred:
+                # Assigning a deferred column means it needn't be loaded
+                name = table_key
+                deferred.discard(name)
+            dirty = d.get('_dirty')
+            if dirty is not None and columns.prefix in name:
+                original = d['_original']
+                compare = value
+                if isinstance(compare, MTModel):
+                    compare = compare.id
+                if name in original and original[name] == compare:
+                    dirty.discard(name)
+                else:
+                    dirty.add(name)
+        if name == 'className':
+            d['_columns'] = get_column_map(value)
+        d[name] = value
 
     def __unicode__(self):
         """
@@ -151,7 +521,8 @@ class MTModel(object):
                 title_str = 'name'
         return u"%s" % getattr(self, title_str)
 
-    def get_week_number(self, created_date):
+    @staticmethod
+    def get_week_number(created_date):
         """
         Used by Movable Type for Entries and Pages.
         """
@@ -161,6 +532,48 @@ class MTModel(object):
         year, week, weekday = model_date.isocalendar()
         return int("%d%02d" % (year, week))
 
+    @classmethod
+    def get_table(self):
+        return self._table or self.__name__.lower()
+
+    @classmethod
+    def filter(self, **kwargs):
+        """
+        Returns a queryset of the model's rows matching the given fields,
+        which can be refined, ordered and sliced further, e.g.:
+        entries = Entry.filter(blog_id=3, status=2).order_by('-authored_on')
+        latest = entries[:50]
+        See queryset.MTQuerySet for the supported lookups.
+        """
+        return queryset.MTQuerySet(self).filter(**kwargs)
+
+    @classmethod
+    def update_where(self, values, **kwargs):
+        """
+        Sets the fields in the values dict on every row matching the
+        given fields with a single UPDATE, rather than loading and saving
+        each object, and returns the number of rows changed, e.g.:
+        Entry.update_where({'status': 2}, blog_id=3, status__in=[1, 3])
+        See MTQuerySet.update. As for delete_where, at least one field is
+        required, so a missing argument can't rewrite the whole table.
+        """
+        if not kwargs:
+            raise Exception("update_where needs at least one condition")
+        return self.filter(**kwargs).update(**values)
+
+    @classmethod
+    def delete_where(self, **kwargs):
+        """
+        Deletes every row matching the given fields with a single DELETE
+        and returns the number of rows deleted, e.g.:
+        ObjectTag.delete_where(blog_id=3, tag_id=15)
+        At least one field is required, so a missing argument can't
+        empty the table.
+        """
+        if not kwargs:
+            raise Exception("delete_where needs at least one condition")
+        return self.filter(**kwargs).delete()
+
     @classmethod
     def get(self, obj_id=None, *args, **kwargs):
         """
@@ -176,6 +589,8 @@ class MTModel(object):
 
 
 class Entry(MTModel):
+    _related = ('author', 'category', 'placement', 'fields')
+    _deferred_columns = ('entry_text', 'entry_text_more')
 
     def __init__(self, *args, **kwargs):
         super(Entry, self).__init__()
@@ -183,14 +598,43 @@ class Entry(MTModel):
                     'title', 'excerpt', 'text',
                     'created_on', 'basename']
         kwargs['week_number'] = self.get_week_number(kwargs['created_on'])
-        if not 'authored_on' in expected:
+        if not 'authored_on' in kwargs:
             kwargs['authored_on'] = kwargs['created_on']
-        kwargs['modified_on'] = kwargs['created_on']
+        if not kwargs.get('modified_on'):
+            kwargs['modified_on'] = kwargs['created_on']
         self.check_keys(expected, kwargs.keys())
         self.reformat_keys(kwargs)
 
+    def load_related(self, key):
+        """
+        entry.author, entry.category and entry.placement (the primary
+        one) are loaded the first time they're used, unless the entry was
+        loaded with them (see MTQuery.get_entry and get_entries). The
+        category and placement are loaded together. entry.fields holds
+        the entry's custom field values (see MTQuery.load_fields).
+        """
+        d = self.__dict__
+        if not self.id:
+            return None
+        mtquery = query.MTQuery()
+        if key == 'fields':
+            mtquery.load_fields([self])
+        elif key == 'author':
+            author = self.author_id
+            if not isinstance(author, MTModel):
+                author = author and mtquery.get_author(author)
+            self.author = author
+        else:
+            placement = mtquery.get_primary_placement(self.id)
+            self.placement = placement
+            self.category = placement and\
+                mtquery.get_object('category', placement.category_id)
+        return d[key]
+
 
 class Page(Entry):
+    _table = 'entry'
+    _class = 'page'
 
     def __init__(self, *args, **kwargs):
         kwargs['class'] = "page"
@@ -200,9 +644,10 @@ class Page(Entry):
                     'title', 'excerpt', 'text',
                     'created_on', 'basename']
         kwargs['week_number'] = self.get_week_number(kwargs['created_on'])
-        if not 'authored_on' in expected:
+        if not 'authored_on' in kwargs:
             kwargs['authored_on'] = kwargs['created_on']
-        kwargs['modified_on'] = kwargs['created_on']
+        if not kwargs.get('modified_on'):
+            kwargs['modified_on'] = kwargs['created_on']
         self.check_keys(expected, kwargs.keys())
         self.reformat_keys(kwargs)
 
@@ -246,6 +691,45 @@ class ObjectTag(MTModel):
         self.check_keys(expected, kwargs.keys())
         self.reformat_keys(kwargs)
 
+    def mark_clean(self):
+        """
+        Also keeps the values the row had when it was loaded or last
+        indexed, until refresh_cache has moved the tag in the index.
+        """
+        d = self.__dict__
+        if '_original' in d:
+            d.setdefault('_indexed', d['_original'])
+        super(ObjectTag, self).mark_clean()
+
+    def refresh_cache(self):
+        """
+        Adds the tag to the blog's cached tag index, if there is one,
+        rather than dropping the whole index. If the row used to tag
+        another object or have another tag, that pair is removed.
+        """
+        super(ObjectTag, self).refresh_cache()
+        previous = self.__dict__.pop('_indexed', None)
+        columns = self.__dict__['_columns']
+        names = ('blog_id', 'object_datasource', 'object_id', 'tag_id')
+        pair = tuple([self.format_value(self.__dict__.get(columns[x]))
+                      for x in names])
+        if previous:
+            old = tuple([self.format_value(previous.get(columns[x]))
+                         for x in names])
+            if old != pair:
+                index = self.get_cached_index(old[0], old[1])
+                if index is not None:
+                    index.remove(old[2], old[3])
+        index = self.get_cached_index(pair[0], pair[1])
+        if index is not None:
+            index.add(pair[2], pair[3])
+
+    @staticmethod
+    def get_cached_index(blog_id, datasource):
+        indexes = object_cache.get('tag_index', blog_id)
+        if indexes:
+            return indexes.get(datasource)
+
 
 class Entry_Meta(MTModel):
 
@@ -265,6 +749,16 @@ class Entry_Meta(MTModel):
         del kwargs['blog_id']
         self.reformat_keys(kwargs)
 
+    def refresh_cache(self):
+        """
+        The cached entry's custom field values (entry.fields) are dropped,
+        so they're reloaded with this change on next use.
+        """
+        super(Entry_Meta, self).refresh_cache()
+        entry = object_cache.get('entry', self.format_value(self.entry_id))
+        if entry is not None:
+            entry.__dict__.pop('fields', None)
+
 
 class Category_Meta(MTModel):
 
@@ -284,6 +778,17 @@ class Category_Meta(MTModel):
         del kwargs['blog_id']
         self.reformat_keys(kwargs)
 
+    def refresh_cache(self):
+        """
+        The cached category's custom field values (category.fields) are
+        dropped, so they're reloaded with this change on next use.
+        """
+        super(Category_Meta, self).refresh_cache()
+        category = object_cache.get('category',
+                                    self.format_value(self.category_id))
+        if category is not None:
+            category.__dict__.pop('fields', None)
+
 
 class Placement(MTModel):
 
@@ -296,6 +801,7 @@ class Placement(MTModel):
 
 
 class Category(MTModel):
+    _related = ('parent', 'fields')
 
     def __init__(self, *args, **kwargs):
         super(Category, self).__init__()
@@ -305,8 +811,38 @@ class Category(MTModel):
         self.check_keys(expected, kwargs.keys())
         self.reformat_keys(kwargs)
 
+    def refresh_cache(self):
+        """
+        The blog's cached category tree is dropped so it's rebuilt with
+        this category's changes on next use.
+        """
+        super(Category, self).refresh_cache()
+        object_cache.invalidate('category_tree', self.blog_id)
+
+    def load_related(self, key):
+        """
+        category.parent holds the parent's id until it's first used, and
+        is then replaced with the parent Category from the blog's cached
+        category tree (see MTQuery.get_category_tree). Top level
+        categories keep a parent of 0. category.fields holds the custom
+        field values, see MTQuery.load_fields.
+        """
+        if key == 'fields':
+            if not self.id:
+                return None
+            query.MTQuery().load_fields([self])
+            return self.__dict__['fields']
+        parent = self.__dict__.get('category_parent')
+        if parent and not isinstance(parent, MTModel):
+            tree = query.MTQuery().get_category_tree(self.blog_id)
+            if tree.get(parent) is not None:
+                self.parent = parent = tree.get(parent)
+        return parent
+
 
 class Folder(Category):
+    _table = 'category'
+    _class = 'folder'
 
     def __init__(self, *args, **kwargs):
         kwargs['class'] = "folder"
@@ -1,15 +1,33 @@
 import models
 
+from cache import object_cache
 from connect import *
 from models import *
+from rows import build_rows
+from tagindex import TagIndex
+from tree import CategoryTree
 
+# Meta table column used to store the value of each custom field type
+FIELD_TYPE_COLUMNS = {'text': 'vchar_idx',
+                      'textarea': 'vclob',
+                      'checkbox': 'vinteger_idx',
+                      'asset.image': 'vclob',
+                      'asset': 'vclob',
+                      'select': 'vchar_idx'}
+
+# Custom field definitions per blog id, see MTQuery.get_field_types
+blog_field_types = {}
+
+# Column names of each table, see MTQuery.get_table_columns
+table_columns = {}
 
 class MTQuery(object):
 
     def __init__(self):
         super(MTQuery, self).__init__()
-        self.conn = MTConnection()
-        self.cache = {}
+        # Reads are spread across any replicas, see MTConnection
+        self.conn = MTConnection(readonly=True)
+        self.cache = object_cache
 
     def get_author(self, author_id):
         return self.get_object('author', author_id)
@@ -18,13 +36,7 @@ class MTQuery(object):
         """
         Returns a list of author objects for the given blog id
         """
-        authors = []
-        query = """SELECT author_id
-                     FROM mt_author"""
-        rows, results = self.conn.execute(query)
-        for author in results:
-            authors.append(self.get_author(author['author_id']))
-        return authors
+        return self.get_objects('author')
 
     def get_asset(self, asset_id):
         return self.get_object('asset', asset_id)
@@ -33,35 +45,48 @@ class MTQuery(object):
         """
         If the category has a parent, i.e. it's not a top hat
         category, the parent category object is fetched and
-        included on the category.parent attribute. Otherwise,
-        category.parent will be equal to 0.
+        included on the category.parent attribute when it's first
+        used. Otherwise, category.parent will be equal to 0.
+
+        Parents are linked by loading the blog's whole category tree in
+        one query (see get_category_tree and Category.load_related)
+        rather than one query per ancestor.
         """
-        category = self.get_object('category', category_id)
-        if category.parent:
-            category.parent = self.get_category(category.parent)
-        return category
+        return self.get_object('category', category_id)
 
     def get_categories(self, blog_id=None, folders=False):
         """
         Returns a list of category objects for the given blog id
+
+        With a blog id, the categories come from the blog's cached
+        category tree. Otherwise all matching rows are fetched with a
+        single query, and parents are linked when first used.
         """
-        categories = []
-        query = """SELECT category_id
-                     FROM mt_category"""
-        if blog_id or folders:
-            query = "%s WHERE" % query
         if blog_id:
-            query = "%s category_blog_id = %d" % (query,
-                                                  blog_id)
+            return self.get_category_tree(blog_id).categories(folders)
+        query = """SELECT *
+                     FROM mt_category"""
         if folders:
-            add_and = ' '
-            if blog_id:
-                add_and = ' AND '
-            query = "%s%scategory_class = 'folder'" % (query, add_and)
+            query = "%s WHERE category_class = 'folder'" % query
         rows, results = self.conn.execute(query)
-        for cat in results:
-            categories.append(self.get_category(cat['category_id']))
-        return categories
+        return [self.load_object('category', row) for row in results]
+
+    def get_category_tree(self, blog_id):
+        """
+        Returns a CategoryTree of every category and folder in the blog,
+        loaded with a single query. Trees are cached per blog until a
+        category in the blog is saved.
+        """
+        tree = self.cache.get('category_tree', blog_id)
+        if tree is None:
+            query = """SELECT *
+                         FROM mt_category
+                        WHERE category_blog_id = %s"""
+            rows, results = self.conn.execute(query, (blog_id,))
+            tree = CategoryTree([self.load_object('category', row)
+                                 for row in results])
+            self.cache.set('category_tree', blog_id, tree)
+        return tree
 
     def get_folders(self, blog_id=None):
         """
@@ -69,24 +94,90 @@ class MTQuery(object):
         """
         return self.get_categories(blog_id, folders=True)
 
-    def get_entry(self, entry_id):
+    def get_entry(self, entry_id, related=False):
         """
-        If a matching entry is found, attach the author, category, and
-        primary placement to the object.
+        Returns the entry. Its author, category, and primary placement are
+        loaded when they're first used (see Entry.load_related), or, with
+        related=True, attached straight away with a single join.
+
+        Entries are cached with their related objects attached, so these
+        are only queried for the first time an entry is loaded. An entry
+        that already has some of them attached gets the rest from
+        prefetch_entries.
         """
         entry = self.get_object('entry', entry_id)
         if entry:
+            if not related:
+                return entry
+            d = entry.__dict__
+            if 'author' in d or 'placement' in d or 'category' in d:
+                return self.prefetch_entries([entry])[0]
             return self.get_entry_meta(entry)
 
+    def get_entries(self, entry_ids, related=True, defer=False):
+        """
+        Returns the entries for a list of ids, in the same order, with
+        their author, category, and primary placement attached unless
+        related is False. Everything is loaded in a fixed number of
+        queries however many entries there are (see prefetch_entries).
+        See get_objects for defer.
+        """
+        entries = self.get_objects('entry', ids=entry_ids, defer=defer)
+        if not related:
+            return entries
+        return self.prefetch_entries(entries)
+
+    def prefetch_entries(self, entries):
+        """
+        Attaches the author, category, and primary placement to each of
+        the given entries that doesn't have them yet, using one query for
+        the placements and one each for the categories and authors not
+        already cached. Entries that share an author or category share
+        the same object. The author and the placement (with the category)
+        are checked separately, since either may have been loaded lazily
+        on its own.
+        """
+        no_author = [x for x in entries if 'author' not in x.__dict__]
+        no_placement = [x for x in entries
+                        if 'placement' not in x.__dict__ or
+                        'category' not in x.__dict__]
+        if no_placement:
+            placements = {}
+            for row in self.select_in('placement', 'placement_entry_id',
+                                      [x.id for x in no_placement],
+                                      "placement_is_primary = 1"):
+                placement = self.load_object('placement', row)
+                placements[placement.entry_id] = placement
+            categories = self.get_objects('category',
+                                          ids=set([x.category_id for x in
+                                                   placements.values()]))
+            categories = dict([(x.id, x) for x in categories])
+            for entry in no_placement:
+                placement = placements.get(entry.id)
+                # Entries without a primary placement (uncategorized
+                # entries, pages) get None, so using them doesn't query
+                # per entry
+                entry.placement = placement
+                entry.category = placement and\
+                    categories.get(placement.category_id)
+        if no_author:
+            authors = self.get_objects('author',
+                                       ids=set([x.author_id for x in
+                                                no_author]))
+            authors = dict([(x.id, x) for x in authors])
+            for entry in no_author:
+                entry.author = authors.get(entry.author_id)
+        return entries
+
     def get_entry_meta(self, entry_object):
         query = """SELECT *
                      FROM mt_placement, mt_category, mt_author
-                    WHERE placement_entry_id = %d
+                    WHERE placement_entry_id = %s
                       AND placement_category_id = category_id
                       AND placement_is_primary = 1
-                      AND author_id = %d""" % (entry_object.id,
-                                               entry_object.author_id)
-        rows, results = self.conn.execute(query)
+                      AND author_id = %s"""
+        rows, results = self.conn.execute(query, (entry_object.id,
+                                                  entry_object.author_id))
         if rows == 1:
             columns = results[0].keys()
             columns.sort()
@@ -114,26 +205,152 @@ class MTQuery(object):
                 instance, get an author's name like: entry.author.name
                 """
                 className = getattr(models, object_type.capitalize())
+                related = self.cache.get(object_type,
+                                         values[object_type]['id'])
+                if related is None:
+                    related = className(**values[object_type])
+                    self.cache.set(object_type, related.id, related)
                 setattr(entry_object,
                         object_type.lower(),
-                        className(**values[object_type]))
+                        related)
         return entry_object
 
-    def get_objects(self, object_type, blog_id=None):
+    def get_objects(self, object_type, blog_id=None, ids=None, compact=False,
+                    defer=False):
         """
         Returns a list of objects for the given type
+
+        Rows are loaded in bulk rather than one query per object: a single
+        SELECT for the whole table (or blog), or, when a list of ids is
+        given, one SELECT per MT_BULK_CHUNK_SIZE ids. Objects are returned
+        in the order of the given ids; ids without a row are skipped.
+
+        Objects already in the shared cache are returned as they are, and
+        only the remaining ids are queried. With a blog_id, cached objects
+        of other blogs are skipped, as their rows would be.
+
+        With compact=True, the rows are returned as slot-based MTRow
+        objects (see rows.py) instead of models, and bypass the cache, so
+        every id given is queried.
+
+        defer leaves large columns out of the SELECT: True for the model's
+        usual ones (entry_text and entry_text_more for entries), or a list
+        of column names. A deferred column is loaded when it's first used
+        (see load_deferred), so listing entry titles doesn't read every
+        entry body.
         """
-        objects = []
-        query = """SELECT %s_id
-                     FROM mt_%s""" % (object_type, object_type)
+        deferred = self.get_deferred_columns(object_type, defer)
+        select = self.get_select_list(object_type, deferred)
+        if ids is None:
+            query = """SELECT %s
+                         FROM mt_%s""" % (select, object_type)
+            args = []
+            if blog_id:
+                query += """ WHERE %s_blog_id = %%s""" % object_type
+                args.append(blog_id)
+            rows, results = self.conn.execute(query, args)
+            if compact:
+                return list(build_rows(object_type, results))
+            return [self.load_object(object_type, row, deferred)
+                    for row in results]
+
+        ids = [int(object_id) for object_id in ids]
+        where, args = None, ()
         if blog_id:
-            query += """ WHERE %s_blog_id = %d""" % (object_type, blog_id)
+            where, args = "%s_blog_id = %%s" % object_type, (blog_id,)
+        if compact:
+            results = self.select_in(object_type, '%s_id' % object_type,
+                                     set(ids), where, args, select)
+            loaded = dict([(x.id, x) for x in build_rows(object_type,
+                                                         results)])
+            return [loaded[x] for x in ids if x in loaded]
+        loaded = {}
+        missing = []
+        for object_id in ids:
+            object = self.cache.get(object_type, object_id)
+            if object is None:
+                missing.append(object_id)
+            elif not blog_id or object.blog_id == blog_id:
+                loaded[object_id] = object
+        for row in self.select_in(object_type, '%s_id' % object_type,
+                                  missing, where, args, select):
+            object = self.load_object(object_type, row, deferred)
+            loaded[object.id] = object
+        return [loaded[x] for x in ids if x in loaded]
 
-        rows, results = self.conn.execute(query)
-        for object in results:
-            objects.append(self.get_object(object_type,
-                                           object["%s_id" % object_type]))
-        return objects
+    def select_in(self, object_type, column, values, where=None, args=(),
+                  select='*'):
+        """
+        Returns the rows of mt_<object_type> whose column matches any of
+        the given values, querying MT_BULK_CHUNK_SIZE values at a time.
+        An extra condition and its parameters can be given in where and
+        args, and the columns to fetch in select.
+        """
+        values = list(values)
+        results = []
+        for i in range(0, len(values), MT_BULK_CHUNK_SIZE):
+            chunk = values[i:i + MT_BULK_CHUNK_SIZE]
+            query = """SELECT %s
+                         FROM mt_%s
+                        WHERE %s IN (%s)""" % (select, object_type, column,
+                                               ', '.join(['%s'] * len(chunk)))
+            if where:
+                query += """ AND %s""" % where
+            rows, chunk_results = self.conn.execute(query,
+                                                    chunk + list(args))
+            results.extend(chunk_results)
+        return results
+
+    def iter_objects(self, object_type, blog_id=None,
+                     batch_size=MT_STREAM_BATCH_SIZE, compact=False,
+                     defer=False):
+        """
+        Generator counterpart to get_objects for exporting large tables,
+        e.g.:
+
+        for comment in mtquery.iter_objects('comment', blog_id=3):
+            ...
+
+        Rows are streamed in id order through MTConnection.iterate and each
+        object is built only when it's reached. Objects are not added to
+        the shared cache, so memory use stays flat however large the
+        table is. Pass compact=True to get slot-based MTRow objects instead
+        of models, and see get_objects for defer.
+        """
+        deferred = self.get_deferred_columns(object_type, defer)
+        query = """SELECT %s
+                     FROM mt_%s""" % (self.get_select_list(object_type,
+                                                           deferred),
+                                      object_type)
+        args = []
+        if blog_id:
+            query += """ WHERE %s_blog_id = %%s""" % object_type
+            args.append(blog_id)
+        query += """ ORDER BY %s_id""" % object_type
+        results = self.conn.iterate(query, args, batch_size)
+        if compact:
+            for row in build_rows(object_type, results):
+                yield row
+        else:
+            for row in results:
+                yield self.build_object(object_type, row, deferred)
+
+    def iter_entries(self, blog_id=None, batch_size=MT_STREAM_BATCH_SIZE,
+                     defer=False):
+        """
+        Streams entries (see iter_objects), attaching their related
+        objects batch_size entries at a time with prefetch_entries.
+        """
+        batch = []
+        for entry in self.iter_objects('entry', blog_id, batch_size,
+                                       defer=defer):
+            batch.append(entry)
+            if len(batch) == batch_size:
+                for entry in self.prefetch_entries(batch):
+                    yield entry
+                batch = []
+        for entry in self.prefetch_entries(batch):
+            yield entry
 
     def get_object(self, object_type, object_id):
         """
@@ -144,38 +361,260 @@ class MTQuery(object):
         Intended for use inside wrappers that may need to add
         additional info (see get_entry and get_category), but as long
         as a corresponding model exists, then this is fine to use.
+
+        Loaded objects are kept in the shared object cache, so a repeated
+        lookup of the same id returns the same instance without a query.
         """
-        query = """SELECT *
-                     FROM mt_%s
-                    WHERE %s_id = %d""" % (object_type,
-                                           object_type,
-                                           int(object_id))
-        rows, results = self.conn.execute(query)
+        object = self.cache.get(object_type, int(object_id))
+        if object is not None:
+            return object
+        className = getattr(models, object_type.capitalize())
+        query = className.get_statement('select', object_type)
+        rows, results = self.conn.execute(query, (int(object_id),))
         if rows == 1:
+            return self.load_object(object_type, results[0])
+
+    def load_object(self, object_type, row, deferred=(), className=None):
+        """
+        Returns the cached instance for a row if there is one, otherwise
+        builds the object from the row and caches it. See build_object
+        for className; a cached object that isn't an instance of it is
+        replaced.
+        """
+        object_id = row['%s_id' % object_type]
+        object = self.cache.get(object_type, object_id)
+        if object is None or\
+                (className and not isinstance(object, className)):
+            object = self.build_object(object_type, row, deferred, className)
+            self.cache.set(object_type, object_id, object)
+        return object
+
+    def build_object(self, object_type, row, deferred=(), className=None):
+        """
+        Creates a model instance from a row of the object's table. The
+        table prefix is stripped from each column name, since models
+        expect the shortened keys (e.g. title rather than entry_title).
+
+        className is the model to create, by default the one named after
+        the table; e.g. Page for a row of mt_entry.
+
+        Columns in deferred were left out of the row. They're recorded
+        on the object, to be loaded when first used.
+        """
+        if className is None:
             className = getattr(models, object_type.capitalize())
-            object_info = {}
-            for key, value in results[0].iteritems():
-                newKey = key.replace('%s_' % object_type.lower(), '')
-                object_info[newKey] = results[0][key]
+        prefix = '%s_' % object_type.lower()
+        object_info = {}
+        for key, value in row.iteritems():
+            newKey = key.replace(prefix, '')
+            object_info[newKey] = value
+        if not deferred:
             return className(**object_info)
+        # Constructors require some of the deferred columns, e.g. text
+        for column in deferred:
+            object_info.setdefault(column.replace(prefix, ''), None)
+        object = className(**object_info)
+        d = object.__dict__
+        for column in deferred:
+            d.pop(column, None)
+        object.mark_clean()
+        d['_deferred'] = set(deferred)
+        return object
+
+    def get_table_columns(self, object_type):
+        """
+        Returns the column names of mt_<object_type>, read once with SHOW
+        COLUMNS and kept for the life of the process.
+        """
+        columns = table_columns.get(object_type)
+        if columns is None:
+            rows, results = self.conn.execute("SHOW COLUMNS FROM mt_%s" %
+                                              object_type)
+            columns = [row['Field'] for row in results]
+            table_columns[object_type] = columns
+        return columns
+
+    def get_deferred_columns(self, object_type, defer):
+        """
+        Returns the column names to leave out of a SELECT for the defer
+        argument of get_objects.
+        """
+        if not defer:
+            return ()
+        if defer is True:
+            className = getattr(models, object_type.capitalize())
+            return className._deferred_columns
+        columns = models.get_column_map(object_type)
+        return tuple([x.startswith(columns.prefix) and x or columns[x]
+                      for x in defer])
+
+    def get_select_list(self, object_type, deferred):
+        if not deferred:
+            return '*'
+        return ', '.join([x for x in self.get_table_columns(object_type)
+                          if x not in deferred])
+
+    def load_deferred(self, objects):
+        """
+        Loads the deferred columns of the given objects (see get_objects)
+        with one query per MT_BULK_CHUNK_SIZE objects of each type. Call
+        it before using a deferred column of many objects, e.g. to show
+        the text of a page of entries, instead of a query per object.
+        """
+        by_type = {}
+        for object in objects:
+            if object.__dict__.get('_deferred'):
+                by_type.setdefault(object.className, []).append(object)
+        for object_type, pending in by_type.items():
+            id_column = '%s_id' % object_type
+            columns = set()
+            for object in pending:
+                columns.update(object.__dict__['_deferred'])
+            select = ', '.join([id_column] + sorted(columns))
+            by_id = dict([(x.id, x) for x in pending])
+            for row in self.select_in(object_type, id_column, by_id.keys(),
+                                      select=select):
+                d = by_id[row[id_column]].__dict__
+                for column in d['_deferred']:
+                    d[column] = row[column]
+                    d['_original'][column] = row[column]
+                d['_deferred'] = set()
+        return objects
+
+    def filter(self, object_type, **kwargs):
+        """
+        Returns a queryset for the given type, e.g.:
+        mtquery.filter('entry', blog_id=3).order_by('-authored_on')[:10]
+        See MTModel.filter.
+        """
+        className = getattr(models, object_type.capitalize())
+        return className.filter(**kwargs)
+
+    def update_where(self, object_type, values, **kwargs):
+        """
+        Updates every row of the given type matching the fields, e.g.:
+        mtquery.update_where('entry', {'author_id': 7}, author_id=4)
+        See MTModel.update_where.
+        """
+        className = getattr(models, object_type.capitalize())
+        return className.update_where(values, **kwargs)
+
+    def delete_where(self, object_type, **kwargs):
+        """
+        Deletes every row of the given type matching the fields. See
+        MTModel.delete_where.
+        """
+        className = getattr(models, object_type.capitalize())
+        return className.delete_where(**kwargs)
 
     def get_placement(self, placement_id):
         return self.get_object('placement', placement_id)
 
+    def get_primary_placement(self, entry_id):
+        results = self.select_in('placement', 'placement_entry_id',
+                                 [entry_id], "placement_is_primary = 1")
+        if results:
+            return self.load_object('placement', results[0])
+
     def get_field_type(self, blog_id, field_name):
-        query = """SELECT field_type
-                     FROM mt_field
-                    WHERE field_blog_id = %d
-                      AND field_basename = '%s'""" % (blog_id,
-                                                      field_name.lower())
-        rows, results = self.conn.execute(query)
-        if rows == 1:
-            return {'text': 'vchar_idx',
-                    'textarea': 'vclob',
-                    'checkbox': 'vinteger_idx',
-                    'asset.image': 'vclob',
-                    'asset': 'vclob',
-                    'select': 'vchar_idx'}.get(results[0]['field_type'], None)
+        """
+        Returns the meta table column (vchar_idx, vclob, ...) that values
+        of the named custom field are stored in, or None if the blog has no
+        such field. Resolved from the blog's cached field definitions.
+        """
+        field_type = self.get_field_types(blog_id).get(field_name.lower())
+        return FIELD_TYPE_COLUMNS.get(field_type, None)
+
+    def get_field_types(self, blog_id, refresh=False):
+        """
+        Returns a dict of {field basename: field type} for every custom
+        field defined in the blog. All of a blog's mt_field rows are
+        loaded in one query the first time, and kept until
+        refresh_field_types is called (or refresh is passed), e.g. after
+        fields are added or changed in MT.
+        """
+        field_types = blog_field_types.get(blog_id)
+        if field_types is None or refresh:
+            query = """SELECT field_basename, field_type
+                         FROM mt_field
+                        WHERE field_blog_id = %s"""
+            rows, results = self.conn.execute(query, (blog_id,))
+            field_types = dict([(row['field_basename'].lower(),
+                                 row['field_type']) for row in results])
+            blog_field_types[blog_id] = field_types
+        return field_types
+
+    def refresh_field_types(self, blog_id=None):
+        """
+        Drops the cached field definitions for a blog, or for every blog,
+        so they're reloaded on next use.
+        """
+        if blog_id is None:
+            blog_field_types.clear()
+        else:
+            blog_field_types.pop(blog_id, None)
+
+    def get_fields(self, object_type, blog_id, object_ids):
+        """
+        Returns {object id: {field basename: value}} with the custom field
+        values of the given entries or categories of a blog (object_type
+        'entry' or 'category'), read from mt_<object_type>_meta with one
+        query per MT_BULK_CHUNK_SIZE ids. Each value comes from the meta
+        column its field's type is stored in (see get_field_type), with
+        checkboxes as bools. Fields an object has no value for are left
+        out of its dict.
+        """
+        fields = dict([(x, {}) for x in object_ids])
+        field_types = self.get_field_types(blog_id)
+        storage = sorted(set([FIELD_TYPE_COLUMNS[x]
+                              for x in field_types.values()
+                              if x in FIELD_TYPE_COLUMNS]))
+        if not fields or not storage:
+            return fields
+        meta = '%s_meta' % object_type
+        id_column = '%s_%s_id' % (meta, object_type)
+        type_column = '%s_type' % meta
+        # Only the columns the blog's field types are stored in
+        select = ', '.join([id_column, type_column] +
+                           ['%s_%s' % (meta, x) for x in storage])
+        rows = self.select_in(meta, id_column, fields.keys(),
+                              "%s LIKE %%s" % type_column, ('field.%',),
+                              select=select)
+        for row in rows:
+            name = row[type_column].replace('field.', '', 1).lower()
+            field_type = field_types.get(name)
+            column = FIELD_TYPE_COLUMNS.get(field_type)
+            if column is None:
+                continue
+            value = row['%s_%s' % (meta, column)]
+            if field_type == 'checkbox' and value is not None:
+                value = bool(value)
+            fields[row[id_column]][name] = value
+        return fields
+
+    def load_fields(self, objects):
+        """
+        Sets object.fields to the dict of custom field values (see
+        get_fields) of each of the given entries, pages, categories or
+        folders, with queries per type and blog rather than per object.
+        Call it before using the fields of many objects, e.g. to render a
+        page of entries:
+
+        for entry in mtquery.load_fields(entries):
+            print entry.fields.get('subtitle')
+
+        Otherwise each object's fields are loaded when first used.
+        """
+        groups = {}
+        for object in objects:
+            key = (object.className, object.blog_id)
+            groups.setdefault(key, []).append(object)
+        for (object_type, blog_id), group in groups.items():
+            fields = self.get_fields(object_type, blog_id,
+                                     [x.id for x in group])
+            for object in group:
+                object.fields = fields[object.id]
+        return objects
 
     def get_tag(self, tag_id):
         return self.get_object('tag', tag_id)
@@ -183,27 +622,105 @@ class MTQuery(object):
     def get_tags(self):
         """
         Returns a list of tag objects for all tags. Caches to assist with
-        high query volume.
+        high query volume; the list is dropped from the cache whenever a
+        tag is saved.
         """
-        tags = []
-        if self.cache.get('tags'):
-            tags = self.cache['tags']
-        else:
-            query = """SELECT tag_id
-                         FROM mt_tag"""
-            rows, results = self.conn.execute(query)
-            for tag in results:
-                tags.append(self.get_tag(tag['tag_id']))
-            self.cache['tags'] = tags
+        tags = self.cache.get('tag', None)
+        if tags is None:
+            tags = self.get_objects('tag')
+            self.cache.set('tag', None, tags)
         return tags
 
+    def get_tag_index(self, blog_id, datasource='entry'):
+        """
+        Returns a TagIndex of the blog's tagged objects of the given
+        datasource ('entry', which includes pages, or 'asset'), loaded
+        from mt_objecttag with one streamed query and cached per blog.
+        Saving an ObjectTag adds or moves it in a cached index; see
+        refresh_tag_index for other changes.
+        """
+        indexes = self.cache.get('tag_index', blog_id)
+        if indexes is None:
+            indexes = {}
+            self.cache.set('tag_index', blog_id, indexes)
+        index = indexes.get(datasource)
+        if index is None:
+            query = """SELECT objecttag_object_id, objecttag_tag_id
+                         FROM mt_objecttag
+                        WHERE objecttag_blog_id = %s
+                          AND objecttag_object_datasource = %s
+                        ORDER BY objecttag_object_id, objecttag_tag_id"""
+            rows = self.conn.iterate(query, (blog_id, datasource))
+            index = TagIndex((row['objecttag_object_id'],
+                              row['objecttag_tag_id']) for row in rows)
+            indexes[datasource] = index
+        return index
+
+    def refresh_tag_index(self, blog_id=None):
+        """
+        Drops the cached tag indexes of a blog, or of every blog, so
+        they're reloaded on next use, e.g. after tags were removed from
+        objects outside this library.
+        """
+        if blog_id is None:
+            self.cache.clear('tag_index')
+        else:
+            self.cache.invalidate('tag_index', blog_id)
+
+    def get_tag_ids(self, tags):
+        """
+        Resolves a list of tags given as ids, Tag objects or names to tag
+        ids. Names are matched case insensitively; unknown names are
+        skipped.
+        """
+        ids = []
+        names = None
+        for tag in tags:
+            if isinstance(tag, basestring):
+                if names is None:
+                    names = dict([(x.name.lower(), x.id)
+                                  for x in self.get_tags()])
+                if tag.lower() in names:
+                    ids.append(names[tag.lower()])
+            else:
+                ids.append(getattr(tag, 'id', tag))
+        return ids
+
+    def get_tagged_entries(self, blog_id, tags, match='all'):
+        """
+        Returns the blog's entries with all (or, with match='any', any)
+        of the given tags, in id order, e.g.:
+        entries = q.get_tagged_entries(3, ['python', 'mysql'])
+
+        The ids come from the tag index, and the entries are loaded with
+        get_entries.
+        """
+        tag_ids = self.get_tag_ids(tags)
+        if len(tag_ids) < len(tags) and match == 'all':
+            return []
+        index = self.get_tag_index(blog_id)
+        return self.get_entries(index.object_ids(tag_ids, match))
+
+    def get_entry_tags(self, blog_id, entry_ids):
+        """
+        Returns {entry id: list of its Tag objects} for the given entries,
+        without querying mt_objecttag per entry.
+        """
+        tag_ids = self.get_tag_index(blog_id).tag_ids_of(entry_ids)
+        all_ids = set()
+        for ids in tag_ids.values():
+            all_ids.update(ids)
+        tags = dict([(x.id, x) for x in self.get_objects('tag',
+                                                         ids=all_ids)])
+        return dict([(entry_id, [tags[x] for x in ids if x in tags])
+                     for entry_id, ids in tag_ids.items()])
 
 if __name__ == '__main__':
     q = MTQuery()
     entry = q.get_entry(5)
 
-    # Parent category object (not included on entry.category by default)
-    parent_cat = q.get_category(entry.category.parent)
+    # Parent category object (loaded when first used)
+    parent_cat = entry.category.parent
     print parent_cat.label
 
     # See the attributes of entry and associated objects
@@ -0,0 +1,443 @@
+import datetime
+import re
+
+import models
+import query
+
+from cache import object_cache
+from config import *
+from connect import MTConnection
+
+# Comparison operators for the lookups accepted by MTQuerySet.filter
+OPERATORS = {'exact': '=',
+             'ne': '!=',
+             'gt': '>',
+             'gte': '>=',
+             'lt': '<',
+             'lte': '<=',
+             'in': 'IN',
+             'isnull': 'IS NULL'}
+
+NAME = re.compile(r'^\w+$')
+
+
+def bind_value(value):
+    """
+    Returns a filter or keyset value as a query parameter, formatted as
+    saved values are (see MTModel.format_value), so e.g. a related
+    Category is bound as its id. Empty values other than None are kept,
+    so filtering on '' doesn't become a comparison with NULL.
+    """
+    if not value:
+        return value
+    return models.MTModel.format_value(value)
+
+# Cached data built from each table's rows (besides the cached objects
+# themselves), dropped after an update or delete. Cached entries hold
+# their author, category and placement, so they go too when those change,
+# and entries and categories hold their custom field values.
+DERIVED_CACHES = {'author': ['entry'],
+                  'category': ['category_tree', 'entry'],
+                  'category_meta': ['category', 'category_tree', 'entry'],
+                  'entry': ['tag_index'],
+                  'entry_meta': ['entry'],
+                  'objecttag': ['tag_index'],
+                  'placement': ['entry']}
+
+
+class MTQuerySet(object):
+
+    def __init__(self, model):
+        """
+        A lazily evaluated SELECT on a model's table, built up by chaining:
+
+        >>> published = Entry.filter(blog_id=3, status=2)
+        >>> recent = published.filter(authored_on__gte='2010-06-01')
+        >>> entries = recent.order_by('-authored_on')[:50]
+
+        Nothing is queried until the results are used (iterated, indexed,
+        len(), etc.), and then a single parameterised SELECT is run, e.g.:
+
+        SELECT * FROM mt_entry
+         WHERE entry_blog_id = %s AND entry_status = %s
+           AND entry_authored_on >= %s
+         ORDER BY entry_authored_on DESC, entry_id DESC LIMIT 50
+
+        Filters use the short attribute names, with an optional lookup
+        suffix (see OPERATORS), e.g. status__in=[1, 2]. The id is always
+        added as the last sort column so the order is stable, which is
+        what keyset pagination (see after and iterator) relies on.
+        """
+        self.model = model
+        self.table = model.get_table()
+        self.where = []
+        self.args = []
+        self.ordering = []
+        self.limit = None
+        self.offset = None
+        self.deferred = ()
+        self.related = False
+        self.results = None
+        if model._class:
+            self.add_condition('class', 'exact', model._class)
+
+    def clone(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.where = list(self.where)
+        clone.args = list(self.args)
+        clone.ordering = list(self.ordering)
+        clone.results = None
+        return clone
+
+    def column(self, name):
+        if not NAME.match(name):
+            raise Exception("Invalid field name: %s" % name)
+        if name.startswith('%s_' % self.table):
+            return name
+        return models.get_column_map(self.table)[name]
+
+    def add_condition(self, name, lookup, value):
+        column = self.column(name)
+        if lookup not in OPERATORS:
+            raise Exception("Unknown lookup '%s' for %s" % (lookup, name))
+        if lookup == 'in':
+            value = list(value)
+            if not value:
+                # Nothing can match an empty list
+                self.where.append("1 = 0")
+                return
+            self.where.append("%s IN (%s)" % (column,
+                                              ', '.join(['%s'] * len(value))))
+            self.args.extend([bind_value(x) for x in value])
+        elif lookup == 'isnull':
+            self.where.append("%s IS %sNULL" % (column,
+                                                not value and 'NOT ' or ''))
+        elif value is None and lookup in ('exact', 'ne'):
+            self.where.append("%s IS %sNULL" % (column,
+                                                lookup == 'ne' and 'NOT '
+                                                or ''))
+        else:
+            self.where.append("%s %s %%s" % (column, OPERATORS[lookup]))
+            self.args.append(bind_value(value))
+
+    def filter(self, **kwargs):
+        """
+        Returns a new queryset with the given conditions ANDed onto the
+        existing ones.
+        """
+        clone = self.clone()
+        for key, value in sorted(kwargs.items()):
+            name, lookup = key, 'exact'
+            if '__' in key:
+                name, lookup = key.rsplit('__', 1)
+            clone.add_condition(name, lookup, value)
+        return clone
+
+    def order_by(self, *fields):
+        """
+        Returns a new queryset sorted by the given fields, each ascending
+        or, with a leading '-', descending. Replaces any earlier order.
+        """
+        clone = self.clone()
+        clone.ordering = []
+        for field in fields:
+            descending = field.startswith('-')
+            clone.ordering.append((clone.column(field.lstrip('-')),
+                                   descending))
+        return clone
+
+    def defer(self, *fields):
+        """
+        Returns a new queryset that leaves the given columns out of the
+        SELECT, or the model's large columns if none are given (see
+        MTQuery.get_objects). They're loaded if they're used later.
+        """
+        clone = self.clone()
+        clone.deferred = query.MTQuery().get_deferred_columns(
+            self.table, fields or True)
+        return clone
+
+    def with_related(self):
+        """
+        Returns a new queryset whose entries come with their author,
+        category, and primary placement attached, loaded in bulk for the
+        whole page of results (see MTQuery.prefetch_entries) rather than
+        one entry at a time when first used.
+        """
+        clone = self.clone()
+        clone.related = True
+        return clone
+
+    def get_ordering(self):
+        """
+        Returns the sort columns with the id appended as a tie-breaker,
+        in the direction of the first sort column.
+        """
+        ordering = list(self.ordering)
+        id_column = '%s_id' % self.table
+        if id_column not in [x[0] for x in ordering]:
+            descending = ordering and ordering[0][1] or False
+            ordering.append((id_column, descending))
+        return ordering
+
+    def after(self, obj):
+        """
+        Returns a new queryset of the rows that come after the given object
+        in this queryset's order, e.g. to fetch the next page:
+
+        page = qs[:50]
+        next_page = qs.after(page[-1])[:50]
+
+        Unlike an OFFSET, this lets MySQL seek straight to the position
+        through the index, so deep pages cost the same as the first one.
+
+        Sort columns may hold NULLs, which MySQL sorts before every other
+        value ascending and after them descending.
+        """
+        ordering = self.get_ordering()
+        values = []
+        for column, descending in ordering:
+            if hasattr(obj, '__dict__') and column in obj.__dict__:
+                values.append(bind_value(obj.__dict__[column]))
+            else:
+                values.append(bind_value(getattr(obj, column)))
+        """
+        Expanded form of (a, b, id) > (x, y, z), which older MySQL
+        versions can't use an index for:
+        a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        A NULL value is matched with IS NULL, and a column's NULLs are
+        included or left out of the rows that follow it as they sort.
+        """
+        clauses = []
+        args = []
+        for i in range(len(ordering)):
+            parts = []
+            part_args = []
+            for (column, descending), value in zip(ordering[:i], values):
+                if value is None:
+                    parts.append("%s IS NULL" % column)
+                else:
+                    parts.append("%s = %%s" % column)
+                    part_args.append(value)
+            column, descending = ordering[i]
+            value = values[i]
+            if value is None:
+                if descending:
+                    # NULLs sort last, so nothing follows in this column
+                    continue
+                parts.append("%s IS NOT NULL" % column)
+            elif descending and column != '%s_id' % self.table:
+                parts.append("(%s < %%s OR %s IS NULL)" % (column, column))
+                part_args.append(value)
+            elif descending:
+                parts.append("%s < %%s" % column)
+                part_args.append(value)
+            else:
+                parts.append("%s > %%s" % column)
+                part_args.append(value)
+            clauses.append("(%s)" % ' AND '.join(parts))
+            args.extend(part_args)
+        clone = self.clone()
+        clone.where.append("(%s)" % ' OR '.join(clauses))
+        clone.args.extend(args)
+        return clone
+
+    def build_query(self, select=None, ordered=True):
+        if select is None:
+            select = query.MTQuery().get_select_list(self.table,
+                                                     self.deferred)
+        sql = "SELECT %s FROM mt_%s" % (select, self.table)
+        if self.where:
+            sql += " WHERE %s" % ' AND '.join(self.where)
+        if ordered:
+            sql += " ORDER BY %s" % ', '.join(['%s%s' % (column,
+                                                         descending and
+                                                         ' DESC' or '')
+                                               for column, descending in
+                                               self.get_ordering()])
+        if self.limit is not None:
+            sql += " LIMIT %d" % self.limit
+            if self.offset:
+                sql += " OFFSET %d" % self.offset
+        return sql, list(self.args)
+
+    def fetch(self):
+        if self.results is None:
+            mtquery = query.MTQuery()
+            sql, args = self.build_query()
+            rows, results = mtquery.conn.execute(sql, args)
+            self.results = [mtquery.load_object(self.table, row,
+                                                self.deferred, self.model)
+                            for row in results]
+            if self.related and self.table == 'entry':
+                mtquery.prefetch_entries(self.results)
+        return self.results
+
+    def __iter__(self):
+        return iter(self.fetch())
+
+    def __len__(self):
+        return len(self.fetch())
+
+    def __getitem__(self, key):
+        """
+        Slicing sets a LIMIT (and OFFSET, if the slice doesn't start at 0)
+        on a new queryset; an index fetches that single row. Negative
+        indices only work on a sliced queryset, which is fetched whole.
+        """
+        if self.results is not None:
+            return self.results[key]
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise Exception("Slicing with a step is not supported")
+            if (key.start or 0) < 0 or (key.stop or 0) < 0:
+                raise Exception("Negative slice bounds are not supported")
+            start = key.start or 0
+            clone = self.clone()
+            clone.offset = (self.offset or 0) + start
+            if key.stop is not None:
+                stop = key.stop
+                if self.limit is not None:
+                    stop = min(stop, self.limit)
+                clone.limit = max(stop - start, 0)
+            elif self.limit is not None:
+                clone.limit = max(self.limit - start, 0)
+            else:
+                # MySQL needs a LIMIT to go with an OFFSET
+                clone.limit = 18446744073709551615
+            return clone
+        if key < 0:
+            # Counting back needs the rows, which only a page can bound
+            if self.limit is None:
+                raise IndexError("Negative indexing needs a sliced "
+                                 "queryset, e.g. qs[:50][-1]")
+            return self.fetch()[key]
+        results = self[key:key + 1].fetch()
+        if not results:
+            raise IndexError("Queryset index out of range")
+        return results[0]
+
+    def first(self):
+        results = self[:1].fetch()
+        return results and results[0] or None
+
+    def count(self):
+        """
+        Returns the number of matching rows with a SELECT COUNT(*), without
+        loading them.
+        """
+        if self.results is not None:
+            return len(self.results)
+        mtquery = query.MTQuery()
+        sql, args = self.build_query('COUNT(*) AS count', ordered=False)
+        if self.limit is not None:
+            sql = "SELECT COUNT(*) AS count FROM (%s) AS page" % \
+                self.build_query()[0]
+        rows, results = mtquery.conn.execute(sql, args)
+        return int(results[0]['count'])
+
+    def check_writable(self):
+        if self.limit is not None or self.offset:
+            raise Exception("Sliced querysets can't be updated or deleted")
+
+    def update(self, **values):
+        """
+        Sets the given fields on every matching row with a single UPDATE,
+        without loading them, and returns the number of rows changed:
+
+        >>> Entry.filter(blog_id=3, status=1).update(status=2)
+        2083
+
+        modified_on is set to the current time unless it's one of the
+        values, and changing an entry's created_on updates its
+        week_number to match, as saving the entry would. Related objects
+        are written as their id.
+
+        Cached copies of the table's objects are dropped, along with the
+        category trees, tag indexes and entries (which hold their author,
+        category and placement) built from them. Objects already loaded
+        keep their old values.
+        """
+        self.check_writable()
+        if not values:
+            return 0
+        columns = models.get_column_map(self.table)
+        table_columns = query.MTQuery().get_table_columns(self.table)
+        changes = {}
+        for name, value in values.items():
+            column = self.column(name)
+            if column not in table_columns:
+                raise Exception("mt_%s has no column %s" % (self.table,
+                                                            column))
+            changes[column] = models.MTModel.format_value(value)
+        if columns['id'] in changes:
+            raise Exception("The id of %s rows can't be updated" %
+                            self.table)
+        modified_on = columns['modified_on']
+        if modified_on not in changes and modified_on in table_columns:
+            changes[modified_on] = datetime.datetime.now().replace(
+                microsecond=0)
+        created_on = columns['created_on']
+        if self.table == 'entry' and changes.get(created_on) and\
+                columns['week_number'] not in changes:
+            changes[columns['week_number']] = \
+                models.MTModel.get_week_number(changes[created_on])
+        assignments = sorted(changes.keys())
+        sql = "UPDATE mt_%s SET %s" % (self.table,
+                                       ', '.join(['%s = %%s' % x
+                                                  for x in assignments]))
+        args = [changes[x] for x in assignments]
+        return self.write(sql, args)
+
+    def delete(self):
+        """
+        Deletes every matching row with a single DELETE, without loading
+        them, and returns the number of rows deleted:
+
+        >>> Entry.filter(blog_id=3, status=3).delete()
+
+        Rows in other tables that refer to them (placements, tags, meta)
+        are left as they are. Cached objects are dropped as for update.
+        """
+        self.check_writable()
+        return self.write("DELETE FROM mt_%s" % self.table, [])
+
+    def write(self, sql, args):
+        if self.where:
+            sql += " WHERE %s" % ' AND '.join(self.where)
+        # Writes go to the primary, see connect.MTConnection
+        conn = MTConnection()
+        rows, results = conn.execute(sql, args + self.args)
+        conn.close()
+        object_cache.clear(self.table)
+        for name in DERIVED_CACHES.get(self.table, ()):
+            object_cache.clear(name)
+        if self.table == 'field':
+            query.blog_field_types.clear()
+        return rows
+
+    def iterator(self, page_size=MT_STREAM_BATCH_SIZE):
+        """
+        Yields every matching object, fetching page_size rows at a time
+        with keyset pagination (see after), so walking a large result
+        never needs an OFFSET scan. On a sliced queryset, only the first
+        page uses its OFFSET, and the pages stop at its LIMIT.
+        """
+        remaining = self.limit
+        # A clone, as slicing a queryset that was already fetched would
+        # slice its results instead
+        page = self.clone()[:page_size]
+        while True:
+            results = page.fetch()
+            for obj in results:
+                yield obj
+            if remaining is not None:
+                remaining -= len(results)
+                if remaining <= 0:
+                    break
+            if len(results) < page.limit:
+                break
+            page = self.after(results[-1])
+            page.limit = page.offset = None
+            page = page[:min(page_size, remaining or page_size)]
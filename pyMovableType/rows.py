@@ -0,0 +1,89 @@
+import operator
+
+
+class MTRow(object):
+    """
+    Compact, read-mostly stand-in for an MTModel, for jobs that hold very
+    many rows at once. Values live in __slots__ named after the table's
+    columns, so there's no per-instance __dict__, and each short name
+    (e.g. row.title for row.entry_title) is a property on the class
+    rather than a __getattr__ lookup.
+
+    Row classes are generated per table and column set by get_row_class.
+    Use to_model() to get a full model, e.g. to change and save it.
+    """
+    __slots__ = ()
+    _table = None
+    _columns = ()
+
+    def __init__(self, *values):
+        for column, value in zip(self._columns, values):
+            setattr(self, column, value)
+
+    @property
+    def className(self):
+        return self._table
+
+    def as_dict(self):
+        """
+        Returns the row's values keyed by short name, as accepted by the
+        model constructors.
+        """
+        prefix = '%s_' % self._table
+        return dict([(column.replace(prefix, '', 1), getattr(self, column))
+                     for column in self._columns])
+
+    def to_model(self):
+        # Imported here since query imports this module, and models
+        # imports query
+        import models
+        className = getattr(models, self._table.capitalize())
+        return className(**self.as_dict())
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.id)
+
+
+# Generated row classes, keyed by (table, columns)
+row_classes = {}
+
+
+def get_row_class(table, columns):
+    """
+    Returns the MTRow subclass for a table and a tuple of its column names,
+    creating it on first use.
+    """
+    key = (table, columns)
+    rowClass = row_classes.get(key)
+    if rowClass is None:
+        attributes = {'__slots__': columns,
+                      '_table': table,
+                      '_columns': columns}
+        prefix = '%s_' % table
+        for column in columns:
+            if column.startswith(prefix):
+                name = column[len(prefix):]
+                attributes[name] = property(operator.attrgetter(column),
+                                            column_setter(column))
+        rowClass = type('%sRow' % table.capitalize(), (MTRow,), attributes)
+        row_classes[key] = rowClass
+    return rowClass
+
+
+def column_setter(column):
+    def setter(self, value):
+        setattr(self, column, value)
+    return setter
+
+
+def build_rows(table, rows):
+    """
+    Generator of compact rows from row dicts as returned by MTConnection.
+    The row class is looked up once, from the columns of the first row.
+    """
+    rowClass = None
+    for row in rows:
+        if rowClass is None:
+            columns = tuple(sorted(row.keys()))
+            rowClass = get_row_class(table, columns)
+        yield rowClass(*[row[x] for x in columns])
@@ -0,0 +1,147 @@
+import models
+
+from connect import *
+
+# Tables in the order their rows have to be inserted, so that the ids
+# of authors, categories and entries exist before the rows that refer to
+# them. Tables not listed here are inserted last.
+TABLE_ORDER = ['author', 'category', 'asset', 'entry', 'placement',
+               'tag', 'objecttag', 'objectasset',
+               'entry_meta', 'category_meta']
+
+
+class MTSession(object):
+
+    def __init__(self, batch_size=MT_BULK_INSERT_SIZE):
+        """
+        A unit of work that collects new and changed models and writes them
+        all in one transaction:
+
+        with MTSession() as session:
+            author = Author(name='ben', nickname='Ben', email='b@example.com')
+            entry = Entry(author_id=author, ...)
+            session.add(entry)
+            session.add(Placement(entry_id=entry, category_id=3, ...))
+
+        On flush, new objects are inserted in dependency order (see
+        TABLE_ORDER) with multi-row INSERTs per table (see
+        MTModel.bulk_save), then changed objects are updated. A model
+        that isn't saved yet can be used as the value of another model's
+        id column, as above; it's written as its id once it's been
+        inserted, and replaced by the id after the flush.
+
+        Leaving the with block commits, or rolls back everything if an
+        exception was raised. Without a with block, call commit() or
+        rollback().
+        """
+        self.batch_size = batch_size
+        self.objects = []
+        self.seen = set()
+        self.conn = None
+        self.inserted = []
+        self.written = []
+        self.snapshots = []
+        self.links = []
+
+    def add(self, obj):
+        """
+        Adds a model, and any models related to it (entry.author etc., as
+        with MTModel.save), to the session.
+        """
+        if id(obj) in self.seen:
+            return
+        self.seen.add(id(obj))
+        self.objects.append(obj)
+        for key, related in obj.__dict__.items():
+            if isinstance(related, models.MTModel):
+                self.add(related)
+
+    def add_all(self, objects):
+        for obj in objects:
+            self.add(obj)
+
+    def flush(self):
+        """
+        Writes every pending new or changed object in the session's
+        transaction, without committing it.
+        """
+        if self.conn is None:
+            self.conn = MTConnection()
+            self.conn.begin()
+        pending = [x for x in self.objects if not x.id or x.is_dirty()]
+        pending.sort(key=self.dependency_order)
+        for obj in pending:
+            self.snapshots.append((obj, dict(obj.__dict__['_original']),
+                                   set(obj.__dict__['_dirty'])))
+        self.links.extend(models.MTModel.get_links(pending))
+        written = []
+        try:
+            models.MTModel.write_many(self.conn, pending, self.batch_size,
+                                      self.inserted, written)
+        except:
+            self.rollback()
+            raise
+        # Written objects are clean as far as the transaction is concerned,
+        # so a later flush only sends what changes after this one
+        for obj in written:
+            obj.mark_clean()
+        self.written.extend(written)
+
+    def dependency_order(self, obj):
+        """
+        Sort key putting new objects in TABLE_ORDER ahead of updates.
+        """
+        if obj.id:
+            return len(TABLE_ORDER) + 1
+        if obj.className in TABLE_ORDER:
+            return TABLE_ORDER.index(obj.className)
+        return len(TABLE_ORDER)
+
+    def commit(self):
+        """
+        Flushes any pending objects and commits the transaction. If the
+        commit fails, the session is rolled back (see rollback) and can
+        be committed again.
+        """
+        self.flush()
+        try:
+            self.conn.commit()
+        except:
+            # Nothing was written, so undo the flushes as rollback() does
+            self.rollback()
+            raise
+        for obj in self.written:
+            obj.refresh_cache()
+        self.reset()
+
+    def rollback(self):
+        """
+        Rolls back everything written since the last commit. Objects that
+        were inserted lose their ids again, and changes made to the models
+        themselves are kept, so they'll be written by the next commit.
+        """
+        if self.conn is not None:
+            self.conn.rollback()
+        models.MTModel.forget_ids(self.inserted)
+        models.MTModel.restore_links(self.links)
+        for obj, original, dirty in reversed(self.snapshots):
+            obj.__dict__['_original'] = original
+            obj.__dict__['_dirty'] = dirty
+        self.reset()
+
+    def reset(self):
+        self.conn = None
+        self.inserted = []
+        self.written = []
+        self.snapshots = []
+        self.links = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
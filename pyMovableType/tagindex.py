@@ -0,0 +1,143 @@
+import bisect
+
+from array import array
+
+
+class TagIndex(object):
+
+    def __init__(self, pairs=()):
+        """
+        An in-memory inverted index of a blog's mt_objecttag rows for one
+        datasource (see MTQuery.get_tag_index), built from (object id,
+        tag id) pairs. For each tag it keeps the sorted ids of the objects
+        with that tag, and for each object the sorted ids of its tags, in
+        arrays of C longs rather than lists of ints, which keeps an index
+        of millions of rows to a few bytes per row.
+
+        Tags can be given as ids or as objects with an id (Tag instances).
+        Objects are always ids, e.g.:
+
+        >>> index.object_ids([5, 8])               # tagged 5 and 8
+        >>> index.object_ids([5, 8], match='any')  # tagged 5 or 8
+        >>> index.tag_ids_of([101, 102])           # {101: [5], 102: []}
+        >>> index.counts()                         # {5: 1200, 8: 35, ...}
+        """
+        self.by_tag = {}
+        self.by_object = {}
+        for object_id, tag_id in pairs:
+            self.add(object_id, tag_id)
+
+    def tag_id(self, tag):
+        return getattr(tag, 'id', tag)
+
+    def insert(self, ids, value):
+        """
+        Adds value to a sorted array unless it's already there. Rows are
+        loaded in (object id, tag id) order, so this nearly always
+        appends.
+        """
+        if not ids or ids[-1] < value:
+            ids.append(value)
+            return True
+        position = bisect.bisect_left(ids, value)
+        if position < len(ids) and ids[position] == value:
+            return False
+        ids.insert(position, value)
+        return True
+
+    def delete(self, ids, value):
+        position = bisect.bisect_left(ids, value)
+        if position < len(ids) and ids[position] == value:
+            ids.pop(position)
+            return True
+        return False
+
+    def add(self, object_id, tag_id):
+        """
+        Records that the object has the tag. Adding a pair that's already
+        indexed does nothing.
+        """
+        tag_ids = self.by_object.get(object_id)
+        if tag_ids is None:
+            tag_ids = self.by_object[object_id] = array('l')
+        if self.insert(tag_ids, tag_id):
+            object_ids = self.by_tag.get(tag_id)
+            if object_ids is None:
+                object_ids = self.by_tag[tag_id] = array('l')
+            self.insert(object_ids, object_id)
+
+    def remove(self, object_id, tag_id):
+        tag_ids = self.by_object.get(object_id)
+        if tag_ids is None or not self.delete(tag_ids, tag_id):
+            return
+        if not tag_ids:
+            del self.by_object[object_id]
+        object_ids = self.by_tag[tag_id]
+        self.delete(object_ids, object_id)
+        if not object_ids:
+            del self.by_tag[tag_id]
+
+    def objects_with(self, tag):
+        """
+        Returns the sorted ids of the objects with the given tag.
+        """
+        return list(self.by_tag.get(self.tag_id(tag), ()))
+
+    def object_ids(self, tags, match='all'):
+        """
+        Returns the sorted ids of the objects with all of the given tags
+        (match='all') or any of them (match='any').
+        """
+        id_lists = [self.by_tag.get(self.tag_id(x), ()) for x in tags]
+        if not id_lists:
+            return []
+        if match == 'any':
+            ids = set()
+            for object_ids in id_lists:
+                ids.update(object_ids)
+        elif match == 'all':
+            # Intersect starting from the rarest tag, so the set stays small
+            id_lists.sort(key=len)
+            ids = set(id_lists[0])
+            for object_ids in id_lists[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(object_ids)
+        else:
+            raise Exception("match must be 'all' or 'any', not %r" % match)
+        return sorted(ids)
+
+    def tags_of(self, object_id):
+        return list(self.by_object.get(object_id, ()))
+
+    def tag_ids_of(self, object_ids):
+        """
+        Returns {object id: sorted list of its tag ids} for the given
+        objects, including an empty list for untagged ones.
+        """
+        return dict([(x, list(self.by_object.get(x, ())))
+                     for x in object_ids])
+
+    def count(self, tag):
+        return len(self.by_tag.get(self.tag_id(tag), ()))
+
+    def counts(self, object_ids=None):
+        """
+        Returns {tag id: number of objects with the tag}, over every
+        object or only the given ones, e.g. for the tag cloud of a page of
+        results.
+        """
+        if object_ids is None:
+            return dict([(tag_id, len(ids))
+                         for tag_id, ids in self.by_tag.iteritems()])
+        counts = {}
+        for object_id in object_ids:
+            for tag_id in self.by_object.get(object_id, ()):
+                counts[tag_id] = counts.get(tag_id, 0) + 1
+        return counts
+
+    def __len__(self):
+        """
+        Number of (object, tag) pairs indexed.
+        """
+        return sum([len(x) for x in self.by_tag.itervalues()])
@@ -0,0 +1,87 @@
+class CategoryTree(object):
+
+    def __init__(self, categories):
+        """
+        An in-memory tree of a blog's categories and folders, built from
+        Category objects that were all loaded at once (see
+        MTQuery.get_category_tree). Each category's parent attribute is set
+        to its parent object from the same tree, so walking up a path never
+        queries the database.
+
+        Lookups are available by id, basename and path, where a path is the
+        basenames from the top level category down joined with '/', e.g.
+        'news/local'. Categories and folders are kept apart for basename
+        and path lookups, since MT lets them share basenames.
+        """
+        self.ordered = list(categories)
+        self.by_id = {}
+        self.by_basename = {}
+        self.by_path = {}
+        self.child_ids = {}
+        for category in categories:
+            self.by_id[category.id] = category
+        for category in categories:
+            parent_id = category.__dict__.get('category_parent')
+            if hasattr(parent_id, 'id'):
+                parent_id = parent_id.id
+            if parent_id in self.by_id:
+                category.parent = self.by_id[parent_id]
+            self.child_ids.setdefault(parent_id or 0, []).append(category.id)
+        for category in categories:
+            key = (self.is_folder(category), category.basename)
+            self.by_basename.setdefault(key, category)
+            self.by_path[(key[0], self.path(category))] = category
+
+    def is_folder(self, category):
+        return category.__dict__.get('category_class') == 'folder'
+
+    def get(self, category_id):
+        return self.by_id.get(category_id)
+
+    def get_by_basename(self, basename, folders=False):
+        """
+        Returns the first category (or folder) found with the given
+        basename. Basenames are only unique among siblings, so use
+        get_by_path where that matters.
+        """
+        return self.by_basename.get((folders, basename))
+
+    def get_by_path(self, path, folders=False):
+        return self.by_path.get((folders, path.strip('/')))
+
+    def path(self, category):
+        basenames = []
+        seen = set()
+        while category is not None and category.id not in seen:
+            seen.add(category.id)
+            basenames.insert(0, category.basename)
+            category = self.parent(category)
+        return '/'.join(basenames)
+
+    def parent(self, category):
+        parent = category.__dict__.get('category_parent')
+        if hasattr(parent, 'id'):
+            return parent
+        return self.by_id.get(parent)
+
+    def children(self, category=None):
+        """
+        Returns the direct children of a category, or the top level
+        categories and folders if no category is given.
+        """
+        parent_id = category is not None and category.id or 0
+        return [self.by_id[x] for x in self.child_ids.get(parent_id, [])]
+
+    def categories(self, folders=False):
+        """
+        Returns every category and folder, or only the folders, matching
+        MTQuery.get_categories.
+        """
+        return [x for x in self.ordered
+                if not folders or self.is_folder(x)]
+
+    def __len__(self):
+        return len(self.ordered)
+
+    def __iter__(self):
+        return iter(self.ordered)